@@ -0,0 +1,105 @@
+import gc
+import tracemalloc
+from typing import Optional
+
+import psutil
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pympler import muppy, summary
+
+from api import profiling, shards, upstream
+from api.breaker import breakers
+from api.cache import response_cache
+from config import appConfig
+
+CACHES = {
+    'response': response_cache,
+    'fragment': upstream.fragment_cache,
+    'last_good': upstream.last_good_cache,
+    'closed_shards': shards.closed_shards,
+}
+ALLOCATION_GROUPS = ('lineno', 'filename', 'traceback')
+ALLOCATION_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not appConfig.ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if x_admin_token != appConfig.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail='Invalid admin token.')
+
+
+router = APIRouter(prefix='/api/v1/admin', dependencies=[Depends(require_admin)])
+
+
+@router.get('/breakers')
+async def get_breakers():
+    return {url: breaker.status() for url, breaker in breakers.items()}
+
+
+@router.get('/memory')
+async def get_memory():
+    memory = psutil.Process().memory_info()
+    out = {
+        'rss_bytes': memory.rss,
+        'vms_bytes': memory.vms,
+        'gc_counts': gc.get_count(),
+        'tracing': tracemalloc.is_tracing(),
+        'caches': {name: {'entries': len(cache), 'bytes': cache.size, 'max_bytes': cache.max_bytes}
+                   for name, cache in CACHES.items()},
+    }
+    if out['tracing']:
+        out['traced_bytes'] = tracemalloc.get_traced_memory()[0]
+    return out
+
+
+@router.get('/memory/cached')
+async def get_largest_cached(limit: int = Query(20, ge=1, le=500)):
+    entries = [{'cache': name, 'key': str(key), 'size_bytes': size}
+               for name, cache in CACHES.items() for key, size in cache.largest(limit)]
+    return sorted(entries, key=lambda entry: entry['size_bytes'], reverse=True)[:limit]
+
+
+# The endpoints below may take a while, so they are plain functions that FastAPI runs off the event loop.
+@router.post('/memory/tracing')
+def start_memory_tracing(frames: int = Query(1, ge=1, le=100)):
+    profiling.start_tracing(frames)
+    return {'tracing': True, 'frames': frames}
+
+
+@router.delete('/memory/tracing')
+def stop_memory_tracing():
+    profiling.stop_tracing()
+    return {'tracing': False}
+
+
+@router.get('/memory/allocations')
+def get_allocations(group_by: str = 'lineno', limit: int = Query(20, ge=1, le=500)):
+    if group_by not in ALLOCATION_GROUPS:
+        raise ValueError(f"Invalid group_by. It needs to be one of {', '.join(ALLOCATION_GROUPS)}.")
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail='Allocation tracing is off. Start it with POST '
+                                                    '/api/v1/admin/memory/tracing.')
+    stats = tracemalloc.take_snapshot().filter_traces(ALLOCATION_FILTERS).statistics(group_by)
+    return {
+        'traced_bytes': sum(stat.size for stat in stats),
+        'allocations': [{'size_bytes': stat.size, 'count': stat.count,
+                         'traceback': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]}
+                        for stat in stats[:limit]],
+    }
+
+
+@router.get('/memory/types')
+def get_types(limit: int = Query(20, ge=1, le=500)):
+    # Shallow sizes of every object the garbage collector knows about, summed by type.
+    rows = sorted(summary.summarize(muppy.get_objects()), key=lambda row: row[2], reverse=True)
+    return [{'type': name, 'count': count, 'size_bytes': size} for name, count, size in rows[:limit]]
+
+
+@router.get('/memory/routes')
+async def get_route_memory():
+    return profiling.route_report()
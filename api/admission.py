@@ -0,0 +1,166 @@
+import asyncio
+import math
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+from api import metrics
+from config import appConfig
+
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super().__init__(f'Shed request: {reason}')
+        self.reason = reason
+        self.retry_after = math.ceil(appConfig.ADMISSION_RETRY_AFTER)
+
+
+# Revalidations and cache warming, which share one tenant quota so that they can't crowd out requests.
+BACKGROUND = 'background'
+
+
+def tenant_of(params):
+    # Distributors see all of their partners' data, so their requests count against the distributor.
+    for key in ('distributor_parent', 'partner_parent'):
+        if params.get(key):
+            return f"{key}:{','.join(sorted(params[key]))}"
+    return 'anonymous'
+
+
+class AdmissionController:
+    """Bounds the upstream calls that fan-outs may have outstanding, overall and per tenant.
+
+    A fan-out reserves one slot per upstream call it may make, charged to the tenants it runs for. Fan-outs that
+    don't fit wait in a bounded queue, which is served in order, skipping tenants that are at their quota so that
+    they can't hold up everyone else. Requests are shed instead when the queue is full or they waited longer than
+    the queue-time SLO. A fan-out larger than a whole quota may still run, on its own.
+    """
+
+    def __init__(self, capacity, tenant_capacity, max_queue, max_wait):
+        self.capacity = capacity
+        self.tenant_capacity = tenant_capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_use = 0
+        self.tenant_in_use = Counter()
+        self.queue = deque()
+
+    def fits_globally(self, charges):
+        return not self.in_use or self.in_use + sum(charges.values()) <= self.capacity
+
+    def fits_tenants(self, charges):
+        return all(not self.tenant_in_use[tenant] or self.tenant_in_use[tenant] + weight <= self.tenant_capacity
+                   for tenant, weight in charges.items())
+
+    def take(self, charges):
+        self.in_use += sum(charges.values())
+        self.tenant_in_use.update(charges)
+        metrics.admission_in_use.set(self.in_use)
+
+    def release(self, charges):
+        self.in_use -= sum(charges.values())
+        self.tenant_in_use.subtract(charges)
+        for tenant in charges:
+            if not self.tenant_in_use[tenant]:
+                del self.tenant_in_use[tenant]
+        metrics.admission_in_use.set(self.in_use)
+        self.dispatch()
+
+    def dispatch(self):
+        skipped = set()
+        for entry in list(self.queue):
+            charges, waiter = entry
+            # Skipped while one of its tenants is at its quota, or has an earlier fan-out waiting.
+            if skipped.intersection(charges) or not self.fits_tenants(charges):
+                skipped.update(charges)
+                continue
+            # Everyone behind the first fan-out waiting for overall capacity waits with it.
+            if not self.fits_globally(charges):
+                break
+            self.queue.remove(entry)
+            self.take(charges)
+            waiter.set_result(None)
+        metrics.admission_queue_depth.set(len(self.queue))
+
+    def overtakes(self, charges):
+        # What dispatch() left queued waits either for overall capacity, which a newcomer must not take first, or for
+        # its tenants' quota, in which case only a newcomer of another tenant may go ahead.
+        return any(self.fits_tenants(queued) or set(queued).intersection(charges) for queued, _ in self.queue)
+
+    def shed(self, reason):
+        metrics.admission_shed.labels(reason).inc()
+        raise Overloaded(reason)
+
+    async def acquire(self, charges):
+        if self.fits_globally(charges) and self.fits_tenants(charges) and not self.overtakes(charges):
+            self.take(charges)
+            return
+        if len(self.queue) >= self.max_queue:
+            self.shed('queue_full')
+        loop = asyncio.get_running_loop()
+        entry = (charges, loop.create_future())
+        self.queue.append(entry)
+        metrics.admission_queue_depth.set(len(self.queue))
+        started = loop.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[1]), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            if entry[1].done():
+                # Admitted just as the wait ended.
+                if timed_out:
+                    return
+                self.release(charges)
+            else:
+                self.queue.remove(entry)
+                # Whoever queued behind it may fit now.
+                self.dispatch()
+            if timed_out:
+                self.shed('queue_timeout')
+            raise
+        finally:
+            metrics.admission_wait_seconds.observe(loop.time() - started)
+
+    @asynccontextmanager
+    async def admit(self, charges):
+        charges = {tenant: max(weight, 1) for tenant, weight in charges.items()}
+        await self.acquire(charges)
+        try:
+            yield
+        finally:
+            self.release(charges)
+
+
+admission = AdmissionController(appConfig.ADMISSION_MAX_UPSTREAM_CALLS, appConfig.ADMISSION_TENANT_UPSTREAM_CALLS,
+                                appConfig.ADMISSION_MAX_QUEUE, appConfig.ADMISSION_QUEUE_TIMEOUT)
+
+
+@asynccontextmanager
+async def admitted_for(charges):
+    """Holds {tenant: upstream calls} slots for the duration of a fan-out run on behalf of several tenants."""
+    if not appConfig.ADMISSION_CONTROL:
+        yield
+        return
+    async with admission.admit(charges):
+        yield
+
+
+def admitted(params, upstream_calls):
+    return admitted_for({tenant_of(params): upstream_calls})
+
+
+async def admitted_stream(params, upstream_calls, frames):
+    """Admits a streamed fan-out before its response starts; the returned frames hold the slots until they end."""
+    held = hold(params, upstream_calls, frames)
+    # Runs up to the admission, so that an Overloaded is raised here rather than half way through a 200.
+    await held.__anext__()
+    return held
+
+
+async def hold(params, upstream_calls, frames):
+    try:
+        async with admitted(params, upstream_calls):
+            yield b''
+            async for frame in frames:
+                yield frame
+    finally:
+        await frames.aclose()
@@ -0,0 +1,83 @@
+import time
+from collections import deque
+
+from config import appConfig
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, url):
+        super().__init__(f'Circuit breaker for {url} is open')
+        self.url = url
+
+
+class CircuitBreaker:
+    """Opens once too many of the recent calls failed or were slow, lets a single probe call through
+    after BREAKER_COOLDOWN, and closes again when that probe succeeds."""
+
+    def __init__(self, url):
+        self.url = url
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.outcomes = deque(maxlen=appConfig.BREAKER_WINDOW)
+
+    def failure_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def allow(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= appConfig.BREAKER_COOLDOWN:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == OPEN:
+            return False
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok, seconds):
+        failed = not ok or seconds > appConfig.BREAKER_SLOW_CALL
+        if self.state == HALF_OPEN:
+            if failed:
+                self.trip()
+            else:
+                self.state = CLOSED
+                self.outcomes.clear()
+            self.probing = False
+            return
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= appConfig.BREAKER_MIN_CALLS and self.failure_rate() >= appConfig.BREAKER_FAILURE_RATE:
+            self.trip()
+
+    def abandon(self):
+        # A call that ended without telling anything about the upstream; the next one gets to probe instead.
+        self.probing = False
+
+    def trip(self):
+        if self.state != OPEN:
+            print(f'Opening circuit breaker for {self.url}, failure rate {self.failure_rate():.0%}')
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def status(self):
+        return {
+            'state': self.state,
+            'failure_rate': round(self.failure_rate(), 3),
+            'calls': len(self.outcomes),
+            'open_for': round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else None,
+        }
+
+
+breakers = {}
+
+
+def breaker_for(url):
+    breaker = breakers.get(url)
+    if breaker is None:
+        breaker = breakers[url] = CircuitBreaker(url)
+    return breaker
@@ -0,0 +1,209 @@
+import hashlib
+import heapq
+import time
+from collections import OrderedDict
+
+import orjson
+
+from api import client
+from api.compression import precompressed
+from api.shared_cache import get_data_from_cache, write_behind
+from config import appConfig
+
+
+class TTLCache:
+    """LRU cache with per-entry expiry, bounded by the total size of what it holds.
+
+    An entry may outlive its ttl by `stale_ttl` seconds: in that window `lookup` still returns it, flagged as stale,
+    so that the caller can serve it while refreshing it.
+    """
+
+    def __init__(self, max_bytes, ttl, stale_ttl=0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        fresh_until, expires_at, size, value = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            self.delete(key)
+            return None, False
+        self._entries.move_to_end(key)
+        return value, fresh_until <= now
+
+    def get(self, key):
+        value, stale = self.lookup(key)
+        return None if stale else value
+
+    def set(self, key, value, size, ttl=None):
+        self.delete(key)
+        if size > self.max_bytes:
+            return
+        fresh_until = time.monotonic() + (ttl or self.ttl)
+        self._entries[key] = (fresh_until, fresh_until + self.stale_ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def largest(self, limit):
+        """(key, size) of the `limit` biggest entries, by the size they were stored with."""
+        return heapq.nlargest(limit, ((key, entry[2]) for key, entry in list(self._entries.items())),
+                              key=lambda item: item[1])
+
+
+def canonical_params(params):
+    # List filters are sets to the data service, so order and duplicates must not produce distinct keys.
+    canonical = {}
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, list):
+            value = sorted({v for v in value if v is not None})
+            if not value:
+                continue
+        if value is None:
+            continue
+        canonical[key] = value
+    return canonical
+
+
+def cache_key(route, params):
+    return f'{route}:' + orjson.dumps(canonical_params(params)).decode()
+
+
+response_cache = TTLCache(appConfig.RESPONSE_CACHE_MAX_BYTES, appConfig.RESPONSE_CACHE_TTL,
+                          appConfig.RESPONSE_CACHE_STALE_TTL)
+
+response_stats = {'hits': 0, 'stale': 0, 'shared_hits': 0, 'misses': 0}
+_refresh_listeners = []
+_revalidating = set()
+_data_version = None
+_data_version_checked_at = 0.0
+
+
+def add_refresh_listener(listener):
+    _refresh_listeners.append(listener)
+
+
+def on_data_refresh():
+    response_cache.clear()
+    for listener in _refresh_listeners:
+        listener()
+
+
+def current_data_version():
+    """The last data_version() seen, or None before the data service first answered. Never waits on the network."""
+    return _data_version
+
+
+async def data_version():
+    """Last-update marker reported by the data service, re-checked at most every DATA_VERSION_CHECK_INTERVAL.
+
+    Only the background poller in api.warmer calls this, so that requests never wait for the check.
+    """
+    global _data_version, _data_version_checked_at
+    now = time.monotonic()
+    if now - _data_version_checked_at < appConfig.DATA_VERSION_CHECK_INTERVAL:
+        return _data_version
+    _data_version_checked_at = now
+    try:
+        r = await client.get(appConfig.DATE_UPDATED_URL, timeout=appConfig.DATA_VERSION_CHECK_TIMEOUT)
+    except Exception as e:
+        print(f'Could not check {appConfig.DATE_UPDATED_URL}: {e!r}')
+        return _data_version
+    if r.status_code == 200 and r.content != _data_version:
+        if _data_version is not None:
+            print('Data service refreshed, invalidating cached review payloads')
+            on_data_refresh()
+        _data_version = r.content
+    return _data_version
+
+
+def etag(key, version):
+    return '"' + hashlib.blake2b(key.encode() + b'\0' + version, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        # If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches, and so does the tag
+        # of a compressed representation of the same payload.
+        candidate = candidate.strip().removeprefix('W/')
+        if candidate == tag or candidate.split('-', 1)[0] + '"' == tag:
+            return True
+    return False
+
+
+def shared_key(version):
+    # Payloads of one data version share a hash, so a refresh moves every worker on to a new one.
+    return 'review:' + hashlib.blake2b(version, digest_size=16).hexdigest()
+
+
+async def get_shared_response(key):
+    """Looks a payload up in the cache shared by all workers, keeping a local copy of what it finds."""
+    if _data_version is None:
+        return None
+    body = await get_data_from_cache(shared_key(_data_version), key)
+    if body is None:
+        return None
+    return store_response(key, body)
+
+
+async def get_cached_response(key):
+    """Returns (body, stale); a stale body may be served but should be refreshed with `revalidate`."""
+    body, stale = response_cache.lookup(key)
+    if body is None:
+        body = await get_shared_response(key)
+        if body is not None:
+            response_stats['shared_hits'] += 1
+            return body, False
+    response_stats['misses' if body is None else 'stale' if stale else 'hits'] += 1
+    return body, stale
+
+
+async def revalidate(key, refresh):
+    # At most one refresh per key runs at a time, and none once another request has already refreshed the entry.
+    if key in _revalidating or not response_cache.lookup(key)[1]:
+        return
+    _revalidating.add(key)
+    try:
+        await refresh()
+    except Exception as e:
+        print(f'Refreshing {key} failed: {e!r}')
+    finally:
+        _revalidating.discard(key)
+
+
+def store_response(key, body):
+    body = precompressed(body)
+    response_cache.set(key, body, len(body) + sum(map(len, body.encoded.values())) + len(key))
+    return body
+
+
+def set_cached_response(key, body, store=True):
+    if not store:
+        return body
+    if _data_version is not None:
+        write_behind(shared_key(_data_version), key, body)
+    return store_response(key, body)
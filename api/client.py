@@ -0,0 +1,79 @@
+import asyncio
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from api import metrics
+from config import appConfig
+
+_client: Optional[httpx.AsyncClient] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_client():
+    limits = httpx.Limits(
+        max_connections=appConfig.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=appConfig.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=appConfig.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    http2 = appConfig.UPSTREAM_HTTP2 and http2_available()
+    if appConfig.UPSTREAM_HTTP2 and not http2:
+        print('UPSTREAM_HTTP2 is set but the h2 package is not installed, falling back to HTTP/1.1')
+    return httpx.AsyncClient(limits=limits, http2=http2, verify=appConfig.UPSTREAM_VERIFY_SSL)
+
+
+async def start_client():
+    global _client
+    if _client is None:
+        _client = create_client()
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_slots.clear()
+
+
+def get_client():
+    # The client is owned by the app lifespan (see main.py); creating it lazily here only
+    # matters for code paths that run outside of the app, e.g. scripts.
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def host_slots(url):
+    host = urlsplit(url).netloc
+    slots = _host_slots.get(host)
+    if slots is None:
+        slots = _host_slots[host] = asyncio.Semaphore(appConfig.UPSTREAM_MAX_CONNECTIONS_PER_HOST)
+    return slots
+
+
+async def get(url, **kwargs):
+    host = urlsplit(url).netloc
+    waiting = metrics.upstream_waiting.labels(host)
+    waiting.inc()
+    try:
+        await host_slots(url).acquire()
+    finally:
+        waiting.dec()
+    in_flight = metrics.upstream_in_flight.labels(host)
+    in_flight.inc()
+    try:
+        return await get_client().get(url, **kwargs)
+    finally:
+        in_flight.dec()
+        _host_slots[host].release()
@@ -0,0 +1,95 @@
+import gzip
+import zlib
+
+from config import appConfig
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Payload(bytes):
+    """Response body that carries its compressed variants, so that serving it from the cache compresses nothing."""
+
+    def __new__(cls, body, encoded=None):
+        payload = super().__new__(cls, body)
+        payload.encoded = encoded or {}
+        return payload
+
+
+def encodings():
+    return [e for e in appConfig.COMPRESSION_ENCODINGS if e == 'gzip' or (e == 'br' and brotli is not None)]
+
+
+def negotiate(accept_encoding):
+    """Picks our most preferred encoding among those the client accepts, or None."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, *parameters = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = None
+        if q is not None:
+            accepted[coding.lower()] = q
+    for encoding in encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=appConfig.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=appConfig.GZIP_LEVEL)
+
+
+def precompressed(body):
+    """Wraps a payload that is about to be cached together with every encoding it may be served with."""
+    if len(body) < appConfig.COMPRESSION_MIN_SIZE:
+        return Payload(body)
+    return Payload(body, {encoding: compress(body, encoding) for encoding in encodings()})
+
+
+def encode(body, accept_encoding):
+    """Returns (content, headers) for a response body, compressed if it is large enough and the client accepts it."""
+    encoding = negotiate(accept_encoding)
+    if encoding is None or len(body) < appConfig.COMPRESSION_MIN_SIZE:
+        return body, {'Vary': 'Accept-Encoding'}
+    content = getattr(body, 'encoded', {}).get(encoding) or compress(body, encoding)
+    return content, {'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+
+
+class StreamCompressor:
+    """Compresses a stream frame by frame, flushing after each one so the client can decode it straight away."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=appConfig.BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(appConfig.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+async def compress_stream(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.finish()
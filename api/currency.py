@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+
+import orjson
+
+from api import client, shards
+from config import appConfig
+
+_rates = {}
+_rates_version = None
+_task = None
+
+
+def read_rates_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def load_rates():
+    if appConfig.FX_RATES_FILE:
+        content = await asyncio.to_thread(read_rates_file, appConfig.FX_RATES_FILE)
+    elif appConfig.FX_RATES_URL:
+        r = await client.get(appConfig.FX_RATES_URL, timeout=appConfig.DATA_VERSION_CHECK_TIMEOUT)
+        r.raise_for_status()
+        content = r.content
+    else:
+        return {}
+    return {code: float(rate) for code, rate in orjson.loads(content).items()}
+
+
+async def refresh_rates():
+    """Reloads the FX table, keeping the last one if that fails."""
+    global _rates, _rates_version
+    try:
+        rates = await load_rates()
+    except Exception as e:
+        print(f'Could not load FX rates: {e!r}')
+        return
+    _rates = rates
+    _rates_version = hashlib.blake2b(orjson.dumps(rates, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+
+
+async def run_fx_refresher():
+    while True:
+        await refresh_rates()
+        await asyncio.sleep(appConfig.FX_RATES_TTL)
+
+
+def start_fx_refresher():
+    # Requests only ever read the current table, which this task reloads every FX_RATES_TTL.
+    global _task
+    if appConfig.CURRENCY_CONVERSION and _task is None:
+        _task = asyncio.ensure_future(run_fx_refresher())
+
+
+async def stop_fx_refresher():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def fx_rates():
+    """Currency code to units per USD; empty until the first load has finished."""
+    return _rates
+
+
+def rates_version(currency):
+    """Identifies the FX table that payloads in `currency` are converted with, or None if they are not converted."""
+    if not appConfig.CURRENCY_CONVERSION or not currency or currency == 'USD' or currency not in _rates:
+        return None
+    return _rates_version
+
+
+def converted(value, fields, rate):
+    if isinstance(value, dict):
+        return {k: v * rate if k in fields and type(v) in (int, float) else converted(v, fields, rate)
+                for k, v in value.items()}
+    if type(value) is list:
+        return [converted(v, fields, rate) for v in value]
+    return value
+
+
+async def convert(fragment, fields, rate):
+    if fragment.raw is not None and len(fragment.raw) > appConfig.DECODE_OFFLOAD_BYTES:
+        data = await asyncio.to_thread(converted, fragment, fields, rate)
+    else:
+        data = converted(fragment, fields, rate)
+    # Same class, so a stale fragment is still reported as stale.
+    return type(fragment)(data, orjson.dumps(data))
+
+
+async def fetch(spec, params, timeout):
+    """Fetches a fragment spec, converting it from the USD fragment when the currency allows it.
+
+    Every currency then shares the one USD upstream call and fragment cache entry.
+    """
+    currency = params.get('currency_code')
+    if appConfig.CURRENCY_CONVERSION and spec.monetary and currency and currency != 'USD':
+        rate = fx_rates().get(currency)
+        if rate is not None:
+            fragment = await shards.fetch(spec, {**params, 'currency_code': 'USD'}, timeout)
+            return await convert(fragment, spec.monetary, rate)
+    return await shards.fetch(spec, params, timeout)
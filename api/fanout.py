@@ -0,0 +1,140 @@
+import asyncio
+import math
+
+import orjson
+from starlette.responses import StreamingResponse
+
+from api import metrics, tables
+from api.compression import compress_stream, negotiate
+from config import appConfig
+
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+class FragmentTimeout(Exception):
+    def __init__(self, url):
+        super().__init__(f'{url} missed the request deadline')
+        self.url = url
+
+
+def route_deadline(route, requested=None):
+    if requested is not None:
+        if not math.isfinite(requested) or requested <= 0:
+            raise ValueError("Invalid deadline. It must be a positive number of seconds.")
+        return max(min(requested, appConfig.MAX_REQUEST_DEADLINE), appConfig.MIN_REQUEST_DEADLINE)
+    return appConfig.ROUTE_DEADLINES.get(route, appConfig.REQUEST_DEADLINE)
+
+
+async def fetch_within(spec, params, deadline_at):
+    budget = min(spec.timeout, deadline_at - asyncio.get_running_loop().time())
+    if budget <= 0:
+        raise FragmentTimeout(spec.url)
+    try:
+        # The shared upstream call always gets the fragment's full budget, whoever starts it: only this caller stops
+        # waiting, while the call keeps going for everyone coalesced onto it and still fills the fragment cache.
+        with metrics.timed(spec.name, 'fragment'):
+            return await asyncio.wait_for(tables.fetch(spec, params, spec.timeout), budget)
+    except asyncio.TimeoutError:
+        raise FragmentTimeout(spec.url)
+
+
+def start_fetches(specs, params, deadline):
+    deadline_at = asyncio.get_running_loop().time() + deadline
+    return deadline_at, {asyncio.ensure_future(fetch_within(spec, params, deadline_at)): spec
+                         for spec in sorted(specs, key=lambda spec: spec.priority)}
+
+
+async def fan_out(specs, params, deadline):
+    """Maps each fragment name to its fragment, or to the exception that kept it out of the response."""
+    _, tasks = start_fetches(specs, params, deadline)
+    done, pending = await asyncio.wait(tasks, timeout=deadline) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+    outcomes = {spec: (task.exception() or task.result()) if task in done else FragmentTimeout(spec.url)
+                for task, spec in tasks.items()}
+    # Keeps the route's own order, which decides precedence when fragments are merged.
+    return {spec.name: outcomes[spec] for spec in specs}
+
+
+async def fan_out_batch(jobs, deadline, concurrency):
+    """Runs each {key: (spec, params)} job once, with at most `concurrency` upstream calls outstanding at a time."""
+    slots = asyncio.Semaphore(concurrency)
+    deadline_at = asyncio.get_running_loop().time() + deadline
+
+    async def run(spec, params):
+        async with slots:
+            return await fetch_within(spec, params, deadline_at)
+
+    ordered = sorted(jobs.items(), key=lambda job: job[1][0].priority)
+    tasks = {asyncio.ensure_future(run(spec, params)): (key, spec) for key, (spec, params) in ordered}
+    done, pending = await asyncio.wait(tasks, timeout=deadline) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+    return {key: (task.exception() or task.result()) if task in done else FragmentTimeout(spec.url)
+            for task, (key, spec) in tasks.items()}
+
+
+async def iter_completed(specs, params, deadline):
+    """Yields (spec, fragment or exception) in the order the upstream calls complete."""
+    deadline_at, tasks = start_fetches(specs, params, deadline)
+    pending = set(tasks)
+    loop = asyncio.get_running_loop()
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(deadline_at - loop.time(), 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                yield tasks[task], task.exception() or task.result()
+        for task in pending:
+            yield tasks[task], FragmentTimeout(tasks[task].url)
+    finally:
+        # The client may disconnect half way through the stream.
+        for task in pending:
+            task.cancel()
+
+
+def fragment_frame(name, fragment):
+    # Spliced from the raw upstream bytes rather than re-encoded, unless they are pretty-printed: a line break inside
+    # a frame would end the NDJSON line or the SSE data field. encode_frame passes bytes through.
+    raw = fragment.raw
+    if not raw or b'\n' in raw or b'\r' in raw:
+        raw = orjson.dumps(fragment)
+    return b'{"fragment":' + orjson.dumps(name) + b',"data":' + raw + b'}'
+
+
+def encode_frame(event, frame, stream):
+    body = frame if isinstance(frame, bytes) else orjson.dumps(frame)
+    if stream == 'sse':
+        return b'event: ' + event.encode() + b'\ndata: ' + body + b'\n\n'
+    return body + b'\n'
+
+
+async def iter_frames(specs, params, deadline, stream):
+    failed = []
+    async for spec, result in iter_completed(specs, params, deadline):
+        if isinstance(result, Exception):
+            print(f'Fragment {spec.name} failed: {result!r}')
+            failed.append(spec.name)
+        else:
+            yield encode_frame('fragment', fragment_frame(spec.name, result), stream)
+    yield encode_frame('done', {'done': True, 'failed': failed}, stream)
+
+
+async def stream_response(specs, params, deadline, stream, accept_encoding=None, admit=None):
+    """`admit`, if given, wraps the frames in a generator that holds the fan-out's admission until they end."""
+    if stream not in STREAM_MEDIA_TYPES:
+        raise ValueError("Invalid stream mode. It needs to be ndjson or sse.")
+    frames = iter_frames(specs, params, deadline, stream)
+    if admit is not None:
+        frames = await admit(frames)
+    headers = {'Vary': 'Accept-Encoding'}
+    encoding = negotiate(accept_encoding)
+    if encoding is not None:
+        frames = compress_stream(frames, encoding)
+        headers['Content-Encoding'] = encoding
+    return StreamingResponse(frames, media_type=STREAM_MEDIA_TYPES[stream], headers=headers)
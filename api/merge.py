@@ -0,0 +1,93 @@
+import asyncio
+
+import orjson
+
+from api import metrics, profiling
+from config import appConfig
+
+# Top-level keys whose values are merged two levels deep, because several fragments contribute to each entry.
+NESTED_KEYS = {'deal_management'}
+
+
+class Fragment(dict):
+    """Decoded upstream fragment that keeps the bytes it was decoded from, so it can be spliced into a response."""
+    __slots__ = ('raw',)
+
+    def __init__(self, data, raw=None):
+        super().__init__(data)
+        self.raw = raw
+
+
+class StaleFragment(Fragment):
+    """Last-known-good copy of a fragment, served while its upstream circuit breaker is open."""
+    __slots__ = ()
+
+
+async def decode(url, content):
+    stage = 'decode:' + url.rstrip('/').rsplit('/', 1)[-1]
+    if len(content) > appConfig.DECODE_OFFLOAD_BYTES:
+        # Large tables would otherwise block the event loop for every other request while they decode.
+        data = await asyncio.to_thread(profiling.measure, stage, orjson.loads, content)
+    else:
+        with profiling.measured(stage):
+            data = orjson.loads(content)
+    if type(data) is not dict:
+        raise TypeError(f'{url} did not return a JSON object')
+    return Fragment(data, content)
+
+
+def merge_into(out, owned, key, value):
+    # `owned` holds the keys whose dict in `out` is our own copy; anything else may still belong to a cached fragment.
+    existing = out.get(key)
+    if type(existing) is not dict or type(value) is not dict:
+        out[key] = value
+        owned.discard(key)
+        return
+    if key not in owned:
+        existing = out[key] = dict(existing)
+        owned.add(key)
+    if key in NESTED_KEYS:
+        nested_owned = set()
+        for k, v in value.items():
+            merge_into(existing, nested_owned, k, v)
+    else:
+        existing.update(value)
+
+
+def merge_fragments(fragments):
+    out = {}
+    owned = set()
+    for fragment in fragments:
+        for key, value in fragment.items():
+            merge_into(out, owned, key, value)
+    return out
+
+
+def splice(fragments, extra):
+    """Joins fragments' raw JSON objects into one without decoding them again, or returns None when it can't."""
+    seen = set(extra)
+    parts = []
+    for fragment in fragments:
+        raw = getattr(fragment, 'raw', None)
+        if raw is None or not seen.isdisjoint(fragment):
+            return None
+        seen.update(fragment)
+        body = raw.strip()[1:-1].strip()
+        if body:
+            parts.append(body)
+    if extra:
+        parts.append(orjson.dumps(extra)[1:-1])
+    return b'{' + b','.join(parts) + b'}'
+
+
+def render(fragments, extra=None):
+    extra = extra or {}
+    with metrics.timed('splice'), profiling.measured('splice'):
+        body = splice(fragments, extra)
+    if body is None:
+        with metrics.timed('merge'), profiling.measured('merge'):
+            out = merge_fragments(fragments)
+            out.update(extra)
+        with metrics.timed('serialise'), profiling.measured('serialise'):
+            body = orjson.dumps(out)
+    return body
@@ -0,0 +1,184 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from starlette.responses import Response
+
+from config import appConfig
+
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+request_seconds = Histogram('review_request_seconds', 'Time to answer a request', ['route', 'status'])
+response_bytes = Histogram('review_response_bytes', 'Size of response bodies as sent', ['route'],
+                           buckets=BYTES_BUCKETS)
+upstream_seconds = Histogram('upstream_request_seconds', 'Time of each call to the data service',
+                             ['fragment', 'status'])
+upstream_bytes = Histogram('upstream_response_bytes', 'Size of data service responses', ['fragment'],
+                           buckets=BYTES_BUCKETS)
+loop_lag = Gauge('event_loop_lag_seconds', 'How late the event loop ran a timer that was due')
+upstream_in_flight = Gauge('upstream_requests_in_flight', 'Calls to the data service holding a connection', ['host'])
+upstream_waiting = Gauge('upstream_requests_waiting', 'Calls to the data service waiting for a connection slot',
+                         ['host'])
+admission_in_use = Gauge('admission_upstream_calls_in_use', 'Upstream call slots held by admitted fan-outs')
+admission_queue_depth = Gauge('admission_queue_depth', 'Fan-outs waiting for upstream call slots')
+admission_wait_seconds = Histogram('admission_wait_seconds', 'Time fan-outs waited to be admitted')
+admission_shed = Counter('admission_shed', 'Requests shed instead of queued', ['reason'])
+
+
+class StatsCollector:
+    """Exposes the counters the caches and the retry logic already keep."""
+
+    def describe(self):
+        # Without it, registering calls collect(), and with it the imports below, while this module is being imported.
+        return []
+
+    def collect(self):
+        # Imported here because those modules record their timings through this one.
+        from api import cache, retry, upstream
+
+        fragments = CounterMetricFamily('fragment_cache_requests', 'Fragment lookups by outcome',
+                                        labels=['fragment', 'result'])
+        for url, stats in list(upstream.fragment_stats.items()):
+            for result, count in stats.items():
+                fragments.add_metric([upstream.fragment_name(url), result], count)
+        yield fragments
+        responses = CounterMetricFamily('response_cache_requests', 'Review payload lookups by outcome',
+                                        labels=['result'])
+        for result, count in cache.response_stats.items():
+            responses.add_metric([result], count)
+        yield responses
+        retries = CounterMetricFamily('upstream_retries', 'Retries and hedged calls to the data service',
+                                      labels=['fragment', 'kind'])
+        for url, stats in list(retry.retry_stats.items()):
+            for kind, count in stats.items():
+                retries.add_metric([upstream.fragment_name(url), kind], count)
+        yield retries
+
+
+REGISTRY.register(StatsCollector())
+
+_timings = ContextVar('timings', default=None)
+_route_paths = {}
+_loop_monitor = None
+
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.entries = []
+
+    def header(self):
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+                         for name, seconds, desc in self.entries)
+
+
+def add_timing(name, seconds, desc=None):
+    timings = _timings.get()
+    if timings is not None:
+        timings.entries.append((name, seconds, desc))
+
+
+def mark_handler_start():
+    # Everything before the handler runs is FastAPI parsing and validating the request.
+    timings = _timings.get()
+    if timings is not None:
+        add_timing('validation', time.perf_counter() - timings.started)
+
+
+@contextmanager
+def timed(name, desc=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - started, desc)
+
+
+def route_path(scope):
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = _route_paths[endpoint] = next(
+            (route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint),
+            endpoint.__name__)
+    return path
+
+
+class MetricsMiddleware:
+    """Times every request, adds a Server-Timing header and records the request histograms."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        timings = Timings()
+        _timings.set(timings)
+        status = 500
+        sent = 0
+
+        async def send_with_timings(message):
+            nonlocal status, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if timings.entries:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'server-timing', timings.header().encode('latin-1'))]
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            route = route_path(scope)
+            request_seconds.labels(route, str(status)).observe(time.perf_counter() - timings.started)
+            response_bytes.labels(route).observe(sent)
+
+
+def observe_upstream(url, status, seconds, size=None):
+    fragment = url.rstrip('/').rsplit('/', 1)[-1]
+    upstream_seconds.labels(fragment, status).observe(seconds)
+    if size is not None:
+        upstream_bytes.labels(fragment).observe(size)
+
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    interval = appConfig.LOOP_LAG_INTERVAL
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag.set(max(loop.time() - expected, 0))
+
+
+def start_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = asyncio.ensure_future(monitor_loop_lag())
+
+
+async def stop_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        try:
+            await _loop_monitor
+        except asyncio.CancelledError:
+            pass
+        _loop_monitor = None
+
+
+router = APIRouter()
+
+
+@router.get('/metrics')
+async def get_metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
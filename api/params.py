@@ -1,8 +1,66 @@
+import inspect
+import re
+from functools import lru_cache
 from typing import Optional, List
 
 import bleach
 from fastapi import Query
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, ValidationError, validator
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.fields import FieldInfo
+
+from api.cache import canonical_params
+from api.registry import FRAGMENTS, SECTIONS
+from config import appConfig
+
+# Parameters consumed by this service itself and never forwarded to the data service.
+SERVICE_PARAMS = {'sections'}
+
+TYPES = frozenset({'partner', 'distributor'})
+TOTAL_OR_ANNUALIZED = frozenset({'TB', 'SYB'})
+CURRENCY_CODES = frozenset({'AED', 'AUD', 'BRL', 'CAD', 'CHF', 'CLP', 'CNY', 'COP', 'CZK', 'DKK', 'EUR', 'GBP', 'HKD',
+                            'IDR', 'ILS', 'INR', 'JPY', 'KRW', 'LKR', 'MXN', 'MYR', 'NOK', 'NZD', 'PHP', 'PLN', 'RUB',
+                            'SEK', 'SGD', 'THB', 'USD', 'ZAR'})
+YES_NO = frozenset({'Yes', 'No'})
+AXES = frozenset({'est_opp_amount', 'on_time_percent', 'par_percent', 'upsell_percent', 'cross_sell_percent',
+                  'perf_percent'})
+DEAL_TYPES = frozenset({'in', 'out', 'closed', 'renewed', 'partners'})
+PERFORMANCE_DEAL_TYPES = DEAL_TYPES | {'original', 'distributors'}
+
+# Printable ASCII other than &, < and >, which bleach.clean() would return unchanged.
+SAFE_VALUE = re.compile(r'[\t\n\x20-\x25\x27-\x3b\x3d\x3f-\x7e]*')
+
+
+@lru_cache(maxsize=4096)
+def bleach_clean(value):
+    return bleach.clean(value)
+
+
+def clean(value):
+    # bleach.clean() parses its input as HTML, which costs far more than the whole rest of the validation.
+    return value if SAFE_VALUE.fullmatch(value) else bleach_clean(value)
+
+
+@lru_cache(maxsize=None)
+def query_defaults(cls):
+    # Query(None) defaults only mean something to FastAPI, so they are passed as None when built from a dict.
+    return {name: None for name, parameter in inspect.signature(cls.__init__).parameters.items()
+            if isinstance(parameter.default, FieldInfo)}
+
+
+@lru_cache(maxsize=None)
+def filter_names(cls):
+    # Fields that __init__ does not name reach the model through its **kwargs.
+    return frozenset(cls.__fields__) | {name for name, parameter in inspect.signature(cls.__init__).parameters.items()
+                                        if name != 'self' and parameter.kind is not parameter.VAR_KEYWORD}
+
+
+def init_arguments(arguments):
+    """Turns the locals() of an __init__ below into the keyword arguments of BaseModel.__init__."""
+    del arguments['self']
+    arguments.pop('__class__', None)
+    arguments.update(arguments.pop('kwargs'))
+    return arguments
 
 
 class RequestParam(BaseModel):
@@ -24,6 +82,7 @@ class RequestParam(BaseModel):
     sub_type: Optional[str] = 'partner'
     user_type: Optional[str] = 'partner'
     partner_tier: Optional[List[str]]
+    sections: Optional[List[str]]
 
     def __init__(self,
                  partner_parent: List[str] = Query(None),
@@ -42,35 +101,38 @@ class RequestParam(BaseModel):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
                  user_type: Optional[str] = 'partner',
                  **kwargs
                  ):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
+
+    @classmethod
+    def from_filters(cls, filters):
+        names = filter_names(cls)
+        # Anything else would be taken for one of __init__'s own arguments, or silently dropped.
+        unknown = [ErrorWrapper(ValueError('Unknown filter.'), loc=key) for key in filters if key not in names]
+        if unknown:
+            raise ValidationError(unknown, cls)
+        return cls(**{**query_defaults(cls), **filters})
 
     @validator('sub_type', 'user_type')
     def type_validation(cls, param):
         if param:
-            if param and param not in ['partner', 'distributor']:
+            if param and param not in TYPES:
                 raise ValueError("Invalid Type. It needs to be Partner or Distributor")
         return param
 
     @validator('total_or_annualized')
     def total_annualized_validation(cls, param):
-        if param and param not in ['TB', 'SYB']:
+        if param and param not in TOTAL_OR_ANNUALIZED:
             raise ValueError("Invalid Total or Annualized parameter. It needs to be TB or SYB.")
         return param
 
     @validator('currency_code')
     def currency_code_validation(cls, currency_code):
-        if currency_code and currency_code not in ['AED', 'AUD', 'BRL', 'CAD', 'CHF', 'CLP', 'CNY', 'COP', 'CZK',
-                                                   'DKK', 'EUR', 'GBP', 'HKD', 'IDR', 'ILS', 'INR', 'JPY', 'KRW', 'LKR',
-                                                   'MXN', 'MYR', 'NOK', 'NZD', 'PHP', 'PLN', 'RUB', 'SEK', 'SGD', 'THB',
-                                                   'USD',
-                                                   'ZAR']:
+        if currency_code and currency_code not in CURRENCY_CODES:
             raise ValueError("Invalid Currency Code.")
         return currency_code
 
@@ -90,7 +152,7 @@ class RequestParam(BaseModel):
 
     @validator('incumbent_partner')
     def incumbent_validation(cls, param):
-        if param and param not in ['Yes', 'No']:
+        if param and param not in YES_NO:
             raise ValueError("Invalid Incumbent Partner parameter. It needs to be Yes or No.")
         return param
 
@@ -101,12 +163,27 @@ class RequestParam(BaseModel):
             raise ValueError("Invalid String. It cannot be a number.")
         return param
 
+    @validator('sections')
+    def sections_validation(cls, sections):
+        if sections:
+            # Accepts both sections=summary,segment and repeated sections=summary&sections=segment.
+            sections = [s.strip() for section in sections if section for s in section.split(',') if s.strip()]
+            unknown = [s for s in sections if s not in SECTIONS and s not in FRAGMENTS]
+            if unknown:
+                raise ValueError(f"Invalid section {unknown[0]}. It needs to be one of {', '.join(sorted(SECTIONS))} "
+                                 f"or a fragment name.")
+        return sections
+
     @validator('*', check_fields=False)
     def sanitize(cls, param):
         if isinstance(param, list):
-            return [bleach.clean(x).strip() if x else x for x in param]
+            return [clean(x).strip() if x else x for x in param]
         elif param:
-            return bleach.clean(param.strip())
+            return clean(param.strip())
+
+    def canonical(self):
+        """The filters that were set, with list filters sorted and deduplicated, e.g. for cache keys."""
+        return canonical_params(self.__dict__)
 
 
 class ReviewRequestParam(RequestParam):
@@ -130,26 +207,55 @@ class ReviewRequestParam(RequestParam):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
                  x: Optional[str] = 'est_opp_amount',
                  y: Optional[str] = 'perf_percent',
                  **kwargs):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
 
     @validator('x', 'y')
     def x_validation(param):
-        if param and param not in ['est_opp_amount', 'on_time_percent', 'par_percent', 'upsell_percent',
-                                   'cross_sell_percent',
-                                   'perf_percent']:
+        if param and param not in AXES:
             raise ValueError("Invalid x. It needs to be est_opp_amount, on_time_percent, par_percent, upsell_percent, "
                              "cross_sell_percent, or perf_percent")
         return param
 
 
-class DealRequestParam(RequestParam):
+class TableRequestParam(RequestParam):
+    page: Optional[str]
+    page_size: Optional[str]
+    sort: Optional[str]
+    fields: Optional[List[str]]
+
+    @validator('page')
+    def page_validation(cls, param):
+        if param:
+            if not param.isdigit() or int(param) <= 0:
+                raise ValueError("Invalid Page. It must be a number from 1.")
+        return param
+
+    @validator('page_size')
+    def page_size_validation(cls, param):
+        if param:
+            if not param.isdigit() or int(param) <= 0 or int(param) > appConfig.TABLE_MAX_PAGE_SIZE:
+                raise ValueError(f"Invalid Page Size. It must be a number from 1 to {appConfig.TABLE_MAX_PAGE_SIZE}.")
+        return param
+
+    @validator('sort')
+    def sort_validation(cls, param):
+        if param and not param.lstrip('-').replace('_', '').isalnum():
+            raise ValueError("Invalid Sort. It needs to be a column name, prefixed with - for descending order.")
+        return param
+
+    @validator('fields')
+    def fields_validation(cls, fields):
+        if fields:
+            fields = [f.strip() for field in fields if field for f in field.split(',') if f.strip()]
+        return fields
+
+
+class DealRequestParam(TableRequestParam):
     deal_type: Optional[str]
 
     def __init__(self,
@@ -170,17 +276,19 @@ class DealRequestParam(RequestParam):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
+                 page: Optional[str] = None,
+                 page_size: Optional[str] = None,
+                 sort: Optional[str] = None,
+                 fields: List[str] = Query(None),
                  **kwargs):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
 
     @validator('deal_type')
     def type_validation(cls, param):
         if param:
-            if param and param not in ['in', 'out', 'closed', 'renewed', 'partners']:
+            if param and param not in DEAL_TYPES:
                 raise ValueError("Invalid Deal Type. It needs to be in, out, closed, renewed, or partners.")
         return param
 
@@ -206,20 +314,16 @@ class CustomerPerformanceRequestParam(RequestParam):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
                  x: Optional[str] = 'est_opp_amount',
                  y: Optional[str] = 'perf_percent',
                  **kwargs):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
 
     @validator('x', 'y')
     def x_validation(param):
-        if param and param not in ['est_opp_amount', 'on_time_percent', 'par_percent', 'upsell_percent',
-                                   'cross_sell_percent',
-                                   'perf_percent']:
+        if param and param not in AXES:
             raise ValueError("Invalid x. It needs to be est_opp_amount, on_time_percent, par_percent, upsell_percent, "
                              "cross_sell_percent, or perf_percent")
         return param
@@ -245,16 +349,14 @@ class CustomerGroupRequestParam(RequestParam):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
                  customer_group: Optional[str] = None,
                  **kwargs):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
 
 
-class PerformanceRequestParam(RequestParam, BaseModel):
+class PerformanceRequestParam(TableRequestParam, BaseModel):
     customer_group: Optional[str]
     deal_type: Optional[str]
 
@@ -275,18 +377,20 @@ class PerformanceRequestParam(RequestParam, BaseModel):
                  total_or_annualized: Optional[str] = 'TB',
                  currency_code: Optional[str] = 'USD',
                  partner_tier: List[str] = Query(None),
+                 sections: List[str] = Query(None),
                  sub_type: Optional[str] = 'partner',
                  customer_group: Optional[str] = None,
                  deal_type: Optional[str] = None,
+                 page: Optional[str] = None,
+                 page_size: Optional[str] = None,
+                 sort: Optional[str] = None,
+                 fields: List[str] = Query(None),
                  **kwargs):
-        a = {key: value for key, value in locals().items() if key != 'self' and key != 'kwargs'}
-        b = {k: v for k, v in kwargs.items()}
-        a.update(b)
-        super().__init__(**a)
+        super().__init__(**init_arguments(locals()))
 
     @validator('deal_type')
     def type_validation(cls, param):
         if param:
-            if param and param not in ['in', 'out', 'closed', 'renewed', 'partners', 'original', 'distributors']:
+            if param and param not in PERFORMANCE_DEAL_TYPES:
                 raise ValueError("Invalid Deal Type. It needs to be in, out, closed, renewed, original, distributors or partners.")
         return param
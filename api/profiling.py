@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from api.metrics import route_path
+
+_request_memory = ContextVar('request_memory', default=None)
+# tracemalloc has a single, process-wide peak, so measured sections take turns while tracing is on.
+_measure_lock = threading.Lock()
+route_memory = defaultdict(lambda: {'requests': 0, 'max_peak_bytes': 0, 'total_peak_bytes': 0,
+                                    'stages': defaultdict(lambda: {'count': 0, 'max_peak_bytes': 0,
+                                                                   'total_peak_bytes': 0})})
+
+
+class RequestMemory:
+    """Memory a request's stages allocated, as measured by `measured`.
+
+    The request's peak is estimated as the largest stage peak plus what the earlier stages still hold, e.g. the
+    decoded fragments that a merge runs on top of.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.held = 0
+        self.peak = 0
+
+    def add(self, stage, peak, retained):
+        self.stages[stage] = max(self.stages.get(stage, 0), peak)
+        self.peak = max(self.peak, self.held + peak)
+        self.held += max(retained, 0)
+
+
+def start_tracing(frames):
+    with _measure_lock:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        route_memory.clear()
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    with _measure_lock:
+        tracemalloc.stop()
+
+
+def on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+@contextmanager
+def measured(stage):
+    request = _request_memory.get()
+    if request is None or not tracemalloc.is_tracing():
+        yield
+        return
+    # Worker threads wait for their turn. The event loop never does: while a thread's section is measured, what runs
+    # on the loop goes unrecorded rather than stall every other request.
+    if not _measure_lock.acquire(blocking=not on_event_loop()):
+        yield
+        return
+    try:
+        if not tracemalloc.is_tracing():
+            # Stopped while this section waited for its turn.
+            yield
+            return
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            request.add(stage, peak - before, current - before)
+    finally:
+        _measure_lock.release()
+
+
+def measure(stage, function, *args):
+    # For asyncio.to_thread, which runs `function` in a copy of the caller's context.
+    with measured(stage):
+        return function(*args)
+
+
+def record(route, request):
+    stats = route_memory[route]
+    stats['requests'] += 1
+    stats['max_peak_bytes'] = max(stats['max_peak_bytes'], request.peak)
+    stats['total_peak_bytes'] += request.peak
+    for stage, peak in request.stages.items():
+        stage_stats = stats['stages'][stage]
+        stage_stats['count'] += 1
+        stage_stats['max_peak_bytes'] = max(stage_stats['max_peak_bytes'], peak)
+        stage_stats['total_peak_bytes'] += peak
+
+
+def route_report():
+    report = {}
+    for route, stats in route_memory.items():
+        stages = {stage: {'count': s['count'], 'max_peak_bytes': s['max_peak_bytes'],
+                          'mean_peak_bytes': s['total_peak_bytes'] // s['count']}
+                  for stage, s in sorted(stats['stages'].items(), key=lambda item: -item[1]['max_peak_bytes'])}
+        report[route] = {'requests': stats['requests'], 'max_peak_bytes': stats['max_peak_bytes'],
+                         'mean_peak_bytes': stats['total_peak_bytes'] // stats['requests'], 'stages': stages}
+    return report
+
+
+class MemoryMiddleware:
+    """Accounts the memory each request's decode, merge and serialise stages allocate, while tracemalloc is on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not tracemalloc.is_tracing():
+            return await self.app(scope, receive, send)
+        request = RequestMemory()
+        _request_memory.set(request)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if request.stages:
+                record(route_path(scope), request)
@@ -0,0 +1,130 @@
+from typing import NamedTuple
+
+from config import appConfig
+
+
+class FragmentSpec(NamedTuple):
+    name: str
+    url: str
+    timeout: float
+    ttl: float
+    # Lower priorities are started first, so cheap summary tiles are not queued behind the large tables.
+    priority: int
+    # Group selected by the sections= query parameter.
+    section: str
+    # Fields holding USD amounts, converted in-process when CURRENCY_CONVERSION is on.
+    monetary: frozenset
+    # Time series fetched one month at a time and assembled here, see SHARD_FRAGMENTS.
+    sharded: bool
+
+
+def fragment(url, section, priority=1):
+    name = url.rstrip('/').rsplit('/', 1)[-1]
+    return FragmentSpec(
+        name=name,
+        url=url,
+        timeout=appConfig.FRAGMENT_TIMEOUTS.get(name, appConfig.FRAGMENT_TIMEOUT),
+        ttl=appConfig.FRAGMENT_CACHE_TTLS.get(name, appConfig.FRAGMENT_CACHE_TTL),
+        priority=priority,
+        section=section,
+        monetary=frozenset(appConfig.MONETARY_FIELDS.get(name, ())),
+        sharded=name in appConfig.SHARD_FRAGMENTS,
+    )
+
+
+FRAGMENTS = {spec.name: spec for spec in (
+    fragment(appConfig.DATE_UPDATED_URL, 'summary', priority=0),
+    fragment(appConfig.TOP_SUMMARY_URL, 'summary', priority=0),
+    fragment(appConfig.TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL, 'summary', priority=0),
+    fragment(appConfig.OPPORTUNITIES_BOOKED_URL, 'summary', priority=0),
+    fragment(appConfig.CUSTOMER_URL, 'summary', priority=0),
+    fragment(appConfig.CUSTOMER_SEGMENT_URL, 'segment'),
+    fragment(appConfig.PERFORMANCE_VALUES_URL, 'performance'),
+    fragment(appConfig.PERFORMANCE_OVER_TIME_URL, 'performance'),
+    fragment(appConfig.PEER_PERFORMANCE_URL, 'performance'),
+    fragment(appConfig.NUMBER_OF_OPPS_URL, 'opportunities'),
+    fragment(appConfig.PERFORMANCE_DATA_URL, 'performance'),
+    fragment(appConfig.PERFORMANCE_CHART_DATA_URL, 'performance'),
+    fragment(appConfig.OPP_AMOUNT_URL, 'opportunities'),
+    fragment(appConfig.GROSS_REVENUE_RETENTION_URL, 'retention'),
+    fragment(appConfig.NET_REVENUE_RETENTION_URL, 'retention'),
+    fragment(appConfig.GET_CUSTOMER_RETENTION_URL, 'retention'),
+    fragment(appConfig.CUSTOMER_RETENTION_CHART_URL, 'retention'),
+    fragment(appConfig.GET_BOOKINGS_PERFORMANCE_AMOUNT, 'performance'),
+    fragment(appConfig.DEAL_MANAGEMENT_TRANSFERRED_IN_URL, 'deals'),
+    fragment(appConfig.DEAL_MANAGEMENT_TRANSFERRED_OUT_URL, 'deals'),
+    fragment(appConfig.DEAL_MANAGEMENT_CLOSED_LOST_URL, 'deals'),
+    fragment(appConfig.GET_OPPORTUNITY_DETAILS_TABLE_URL, 'tables', priority=2),
+    fragment(appConfig.GET_DETAILS_BY_CUSTOMER_TABLE_URL, 'tables', priority=2),
+    fragment(appConfig.DEAL_MANAGEMENT_OPPORTUNITY_DETAILS_TABLE_URL, 'tables', priority=2),
+)}
+
+SECTIONS = {spec.section for spec in FRAGMENTS.values()}
+
+# Fragments fetched by each review route, per audience. Adding a tile to a route is a matter of listing it here.
+ROUTES = {
+    'review': {
+        'partner': [
+            'total-opp-amount', 'booked-opps', 'customers', 'customer-segment', 'performance-values',
+            'performance-over-time', 'peer-performance', 'number-of-opps', 'performance-data', 'opp-amount',
+            'gross-rev', 'customer-retention-rate', 'date-updated',
+        ],
+        'distributor': [
+            'top-summary', 'customer-segment', 'performance-values', 'performance-over-time', 'peer-performance',
+            'number-of-opps', 'performance-data', 'opp-amount', 'gross-rev', 'date-updated',
+        ],
+    },
+    'performance': {
+        'partner': [
+            'total-opp-amount', 'booked-opps', 'customers', 'customer-retention-chart', 'bookings-performance-amount',
+            'gross-rev', 'net-rev', 'customer-retention-rate', 'opp-details-table', 'details-by-customer',
+            'customer-segment', 'date-updated',
+        ],
+        'distributor': [
+            'top-summary', 'customer-retention-chart', 'bookings-performance-amount', 'gross-rev', 'net-rev',
+            'customer-retention-rate', 'opp-details-table', 'details-by-customer', 'customer-segment', 'date-updated',
+        ],
+    },
+    'deal-management': {
+        'partner': [
+            'total-opp-amount', 'booked-opps', 'customers', 'transferred-in', 'transferred-out', 'closed-lost',
+            'deal-management-opp-details', 'net-rev', 'opp-amount', 'date-updated',
+        ],
+        'distributor': [
+            'top-summary', 'transferred-in', 'transferred-out', 'closed-lost', 'deal-management-opp-details',
+            'net-rev', 'opp-amount', 'date-updated',
+        ],
+    },
+    'customer-performance': {
+        'partner': ['total-opp-amount', 'booked-opps', 'customers', 'performance-chart-data'],
+        'distributor': ['top-summary', 'performance-chart-data'],
+    },
+}
+
+
+def audience(params):
+    if params.get('sub_type') == 'distributor' or params.get('user_type') == 'distributor':
+        return 'distributor'
+    return 'partner'
+
+
+def route_fragments(route, params, sections=None):
+    specs = [FRAGMENTS[name] for name in ROUTES[route][audience(params)]]
+    if sections:
+        valid = {spec.section for spec in specs}
+        if not set(sections) <= valid | {spec.name for spec in specs}:
+            raise ValueError(f"Invalid sections for this route. They need to be {', '.join(sorted(valid))} "
+                             f"or the name of one of their fragments.")
+        specs = [spec for spec in specs if spec.section in sections or spec.name in sections]
+    elif not appConfig.INLINE_TABLES:
+        # The tables are then served page by page from the table routes.
+        specs = [spec for spec in specs if spec.section != 'tables']
+    return specs
+
+
+def route_table(route, table, params):
+    spec = FRAGMENTS.get(table)
+    tables = [name for name in ROUTES[route][audience(params)] if FRAGMENTS[name].section == 'tables']
+    if spec is None or table not in tables:
+        raise ValueError(f"Invalid table. It needs to be {' or '.join(tables)}.")
+    return spec
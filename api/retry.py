@@ -0,0 +1,129 @@
+import asyncio
+import random
+from collections import defaultdict, deque
+
+import httpx
+
+from api import client, metrics
+from config import appConfig
+
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class LatencyWindow:
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self.samples) < appConfig.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class RetryBudget:
+    """Every first attempt earns `ratio` of a token and every retry or hedge spends a whole one,
+    which caps the extra load at roughly `ratio` of the normal load, plus a small burst."""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, self.burst)
+
+    def withdraw(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+latencies = defaultdict(LatencyWindow)
+retry_stats = defaultdict(lambda: {'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'budget_exhausted': 0})
+budget = RetryBudget(appConfig.RETRY_BUDGET_RATIO, appConfig.RETRY_BUDGET_BURST)
+
+
+def policy_for(url):
+    name = url.rstrip('/').rsplit('/', 1)[-1]
+    return {'retries': appConfig.UPSTREAM_RETRIES, 'hedge': False, **appConfig.UPSTREAM_POLICIES.get(name, {})}
+
+
+def spend(url):
+    if budget.withdraw():
+        return True
+    retry_stats[url]['budget_exhausted'] += 1
+    return False
+
+
+async def timed_get(url, params, timeout):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        r = await client.get(url, params=params, timeout=timeout)
+    except asyncio.CancelledError:
+        metrics.observe_upstream(url, 'cancelled', loop.time() - started)
+        raise
+    except Exception:
+        metrics.observe_upstream(url, 'error', loop.time() - started)
+        raise
+    metrics.observe_upstream(url, str(r.status_code), loop.time() - started, len(r.content))
+    if r.status_code < 500:
+        latencies[url].add(loop.time() - started)
+    return r
+
+
+async def hedged_get(url, params, timeout, hedge):
+    delay = latencies[url].percentile(0.95) if hedge else None
+    if delay is None or (timeout is not None and delay >= timeout):
+        return await timed_get(url, params, timeout)
+    primary = asyncio.ensure_future(timed_get(url, params, timeout))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not spend(url):
+            return await primary
+        retry_stats[url]['hedges'] += 1
+        tasks.add(asyncio.ensure_future(timed_get(url, params, timeout - delay if timeout else None)))
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # The first answer wins, unless it failed while the other request is still running.
+            winners = [task for task in done if task.exception() is None]
+            if winners or not tasks:
+                winner = (winners or list(done))[0]
+                if winner is not primary:
+                    retry_stats[url]['hedge_wins'] += 1
+                return winner.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get(url, params=None, timeout=None):
+    """GET with jittered retries on connect errors and 5xx, hedged for slow fragments, within `timeout` overall."""
+    policy = policy_for(url)
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + timeout if timeout else None
+    budget.deposit()
+    attempt = 0
+    while True:
+        r, error = None, None
+        try:
+            r = await hedged_get(url, params, give_up_at - loop.time() if give_up_at else None, policy['hedge'])
+        except RETRYABLE_ERRORS as e:
+            error = e
+        if r is not None and r.status_code < 500:
+            return r
+        backoff = random.uniform(0, appConfig.UPSTREAM_RETRY_BACKOFF * 2 ** attempt)
+        out_of_time = give_up_at is not None and loop.time() + backoff >= give_up_at
+        if attempt >= policy['retries'] or out_of_time or not spend(url):
+            if error is not None:
+                raise error
+            return r
+        attempt += 1
+        retry_stats[url]['retries'] += 1
+        await asyncio.sleep(backoff)
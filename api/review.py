@@ -1,211 +1,135 @@
-import asyncio
 import json
 import traceback
+from collections import Counter
 from datetime import datetime
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional
+
 from fastapi.responses import ORJSONResponse
 import httpx
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, Request
+from pydantic import ValidationError
+from starlette.responses import JSONResponse, Response
 from dateutil.relativedelta import relativedelta
-from api.params import RequestParam, PerformanceRequestParam, CustomerPerformanceRequestParam, DealRequestParam
+from api import currency, metrics, profiling
+from api.admission import BACKGROUND, admitted, admitted_for, admitted_stream, tenant_of
+from api.breaker import CircuitOpenError
+from api.fanout import FragmentTimeout, fan_out, fan_out_batch, route_deadline, stream_response
+from api.compression import encode, negotiate
+from api.cache import cache_key as response_cache_key, current_data_version, etag, etag_matches, get_cached_response, \
+    get_shared_response, revalidate, set_cached_response
+from api.merge import StaleFragment, render
+from api.registry import route_fragments, route_table
+from api.shards import upstream_calls
+from api.tables import paginate, split_options
+from api.upstream import UpstreamError, fragment_key
+from api.warmer import record_traffic
+from api.params import SERVICE_PARAMS, RequestParam, PerformanceRequestParam, CustomerPerformanceRequestParam, \
+    DealRequestParam
 from config import appConfig
 
 router = APIRouter()
 
+ROUTE_PARAMS = {
+    'review': RequestParam,
+    'performance': PerformanceRequestParam,
+    'deal-management': DealRequestParam,
+    'customer-performance': CustomerPerformanceRequestParam,
+}
+
 @router.get("/api/v1/review", response_class=ORJSONResponse)
-async def async_get(request_params: RequestParam = Depends(RequestParam)):
-    params = set_default_dates(request_params)
-    '''cache_key = 'TEST_ACCOUNT'
-    cache_field = f'review_performance_benchmark_{json.dumps(params)}'
-    cached_data = await get_data_from_cache(cache_key, cache_field)
-
-    if cached_data and cached_data != '{}':
-        return json.loads(cached_data)'''
-    async with httpx.AsyncClient(verify=False) as client:
-        for key, value in dict(params).items():
-            if value is None:
-                del params[key]
-        timeout = None
-        if params.get('sub_type') == 'distributor' or params.get('user_type') == 'distributor':
-            results = await asyncio.gather(
-                client.get(appConfig.TOP_SUMMARY_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_SEGMENT_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_VALUES_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_OVER_TIME_URL, params=params, timeout=timeout),
-                client.get(appConfig.PEER_PERFORMANCE_URL, params=params, timeout=timeout),
-                client.get(appConfig.NUMBER_OF_OPPS_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_DATA_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.GROSS_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-        else:
-            results = await asyncio.gather(
-                client.get(appConfig.TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPPORTUNITIES_BOOKED_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_SEGMENT_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_VALUES_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_OVER_TIME_URL, params=params, timeout=timeout),
-                client.get(appConfig.PEER_PERFORMANCE_URL, params=params, timeout=timeout),
-                client.get(appConfig.NUMBER_OF_OPPS_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_DATA_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.GROSS_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_CUSTOMER_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-
-    #for s in snapshot.statistics("filename"):
-     #   print(s)
-    #for s in snapshot.statistics("lineno"):
-     #   print(s)
-    await client.aclose()
-
-    return get_output(results)
+async def async_get(request: Request, background_tasks: BackgroundTasks,
+                    request_params: RequestParam = Depends(RequestParam),
+                    stream: Optional[str] = None, deadline: Optional[float] = None):
+    return await get_review('review', request, request_params, background_tasks, stream, deadline)
 
 
 @router.get("/api/v1/review/performance", response_class=ORJSONResponse)
-async def async_get_performance(request_params: PerformanceRequestParam = Depends(PerformanceRequestParam)):
-    params = set_default_dates(request_params)
-    '''cache_key = 'TEST_ACCOUNT'
-    cache_field = f'review_performance_benchmark_{json.dumps(params)}'
-    cached_data = await get_data_from_cache(cache_key, cache_field)
-    if cached_data and cached_data != '{}':
-        return json.loads(cached_data)'''
-    results = None
-    async with httpx.AsyncClient() as client:
-        for key, value in dict(params).items():
-            if value is None:
-                del params[key]
-        timeout = httpx.Timeout(timeout=30)
-        if params.get('sub_type') == 'distributor' or params.get('user_type') == 'distributor':
-            results = await asyncio.gather(
-                client.get(appConfig.TOP_SUMMARY_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_RETENTION_CHART_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_BOOKINGS_PERFORMANCE_AMOUNT, params=params, timeout=timeout),
-                client.get(appConfig.GROSS_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.NET_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_CUSTOMER_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_OPPORTUNITY_DETAILS_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_DETAILS_BY_CUSTOMER_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_SEGMENT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-        else:
-            results = await asyncio.gather(
-                client.get(appConfig.TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPPORTUNITIES_BOOKED_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_RETENTION_CHART_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_BOOKINGS_PERFORMANCE_AMOUNT, params=params, timeout=timeout),
-                client.get(appConfig.GROSS_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.NET_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_CUSTOMER_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_OPPORTUNITY_DETAILS_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.GET_DETAILS_BY_CUSTOMER_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_SEGMENT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-
-    # return get_output(results)
-    out = {}
-    for r in results:
-        if isinstance(r, Exception):
-            print(f'Exception occurred...{r.request}')
-            print(''.join(traceback.format_exception(etype=type(r), value=r, tb=r.__traceback__)))
-        elif r.status_code != 200:
-            print(f'Request failed.{r.request}')
-        else:
-            print(r)
-            print(r.status_code)
-            d = dict(r.json())
-            for key, value in d.items():
-                if key in out and type(value) is dict:
-                    if key == 'deal_management':
-                        for k, v in value.items():
-                            if k in out[key] and type(out[key][k]) is dict:
-                                out[key][k].update(v)
-                            elif type(out[key]) is dict:
-                                out[key].update(value)
-                    else:
-                        out[key].update(value)
-                else:
-                    out.update(d)
-
-
-    return out
-    '''print(f'cache_key: {cache_key}')
-    print(f'cache_field: {cache_field}')
-    background_tasks.add_task(parse_data_to_cache, key=cache_key, field=cache_field, data=json.dumps(out))'''
+async def async_get_performance(request: Request, background_tasks: BackgroundTasks,
+                                request_params: PerformanceRequestParam = Depends(PerformanceRequestParam),
+                                stream: Optional[str] = None, deadline: Optional[float] = None):
+    return await get_review('performance', request, request_params, background_tasks, stream, deadline)
 
 
 @router.get("/api/v1/review/deal-management", response_class=ORJSONResponse)
-async def async_get(request_params: RequestParam = Depends(DealRequestParam)
-):
-    params = set_default_dates(request_params)
-    async with httpx.AsyncClient() as client:
-        for key, value in dict(params).items():
-            if value is None:
-                del params[key]
-        timeout = httpx.Timeout(timeout=30)
-        if params.get('sub_type') == 'distributor' or params.get('user_type') == 'distributor':
-            results = await asyncio.gather(
-                client.get(appConfig.TOP_SUMMARY_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_TRANSFERRED_IN_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_TRANSFERRED_OUT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_CLOSED_LOST_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_OPPORTUNITY_DETAILS_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.NET_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-        else:
-            results = await asyncio.gather(
-                client.get(appConfig.TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPPORTUNITIES_BOOKED_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_TRANSFERRED_IN_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_TRANSFERRED_OUT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_CLOSED_LOST_URL, params=params, timeout=timeout),
-                client.get(appConfig.DEAL_MANAGEMENT_OPPORTUNITY_DETAILS_TABLE_URL, params=params, timeout=timeout),
-                client.get(appConfig.NET_REVENUE_RETENTION_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.DATE_UPDATED_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-
-    return get_output(results)
+async def async_get_deal_management(request: Request, background_tasks: BackgroundTasks,
+                                    request_params: DealRequestParam = Depends(DealRequestParam),
+                                    stream: Optional[str] = None, deadline: Optional[float] = None):
+    return await get_review('deal-management', request, request_params, background_tasks, stream, deadline)
 
 
 @router.get("/api/v1/review/customer-performance", response_class=ORJSONResponse)
-async def customer_performance(request_params: CustomerPerformanceRequestParam = Depends(CustomerPerformanceRequestParam),
-):
-    params = set_default_dates(request_params)
-    async with httpx.AsyncClient() as client:
-        for key, value in dict(params).items():
-            if value is None:
-                del params[key]
-        timeout = httpx.Timeout(timeout=30)
-        if params.get('sub_type') == 'distributor' or params.get('user_type') == 'distributor':
-            results = await asyncio.gather(
-                client.get(appConfig.TOP_SUMMARY_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_CHART_DATA_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-        else:
-            results = await asyncio.gather(
-                client.get(appConfig.TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL, params=params, timeout=timeout),
-                client.get(appConfig.OPPORTUNITIES_BOOKED_URL, params=params, timeout=timeout),
-                client.get(appConfig.CUSTOMER_URL, params=params, timeout=timeout),
-                client.get(appConfig.PERFORMANCE_CHART_DATA_URL, params=params, timeout=timeout),
-                return_exceptions=True
-            )
-    return get_output(results)
+async def customer_performance(request: Request, background_tasks: BackgroundTasks,
+                               request_params: CustomerPerformanceRequestParam = Depends(CustomerPerformanceRequestParam),
+                               stream: Optional[str] = None, deadline: Optional[float] = None):
+    return await get_review('customer-performance', request, request_params, background_tasks, stream, deadline)
+
+
+@router.get("/api/v1/review/performance/tables/{table}", response_class=ORJSONResponse)
+async def performance_table(request: Request, table: str,
+                            request_params: PerformanceRequestParam = Depends(PerformanceRequestParam),
+                            deadline: Optional[float] = None):
+    return await get_table('performance', table, request, request_params, deadline)
+
+
+@router.get("/api/v1/review/deal-management/tables/{table}", response_class=ORJSONResponse)
+async def deal_management_table(request: Request, table: str,
+                                request_params: DealRequestParam = Depends(DealRequestParam),
+                                deadline: Optional[float] = None):
+    return await get_table('deal-management', table, request, request_params, deadline)
+
+
+@router.post("/api/v1/review/batch", response_class=ORJSONResponse)
+async def review_batch(request: Request, background_tasks: BackgroundTasks,
+                       filter_sets: List[Dict[str, Any]] = Body(...), deadline: Optional[float] = None):
+    metrics.mark_handler_start()
+    deadline = route_deadline('batch', deadline)
+    if len(filter_sets) > appConfig.BATCH_MAX_SIZE:
+        raise ValueError(f"Too many filter sets. A batch can hold at most {appConfig.BATCH_MAX_SIZE}.")
+    requests = []
+    errors = []
+    for index, filter_set in enumerate(filter_sets):
+        try:
+            requests.append(RequestParam.from_filters(filter_set))
+        except ValidationError as e:
+            errors.append({'index': index, 'errors': json.loads(e.json())})
+    if errors:
+        return JSONResponse(errors, status_code=422)
+
+    bodies = {}
+    pending = {}
+    jobs = {}
+    charges = Counter()
+    for index, request_params in enumerate(requests):
+        params, specs, upstream_params = prepare_review('review', request_params)
+        cache_key = payload_key('review', params)
+        cached, stale = await get_cached_response(cache_key)
+        if cached is not None:
+            if stale:
+                background_tasks.add_task(revalidate, cache_key,
+                                          partial(refresh_review, cache_key, specs, upstream_params, 'batch'))
+            bodies[index] = cached
+            continue
+        # Identical (url, params) pairs across the batch collapse into a single job, charged to the tenant of the
+        # first filter set that needs it.
+        fragment_keys = {spec.name: fragment_key(spec.url, upstream_params) for spec in specs}
+        for spec in specs:
+            if fragment_keys[spec.name] not in jobs:
+                jobs[fragment_keys[spec.name]] = (spec, upstream_params)
+                charges[tenant_of(params)] += upstream_calls([spec], upstream_params)
+        pending[index] = (cache_key, fragment_keys)
+
+    fetched = {}
+    if jobs:
+        # No tenant can have more calls outstanding than the batch as a whole.
+        charges = {tenant: min(calls, appConfig.BATCH_CONCURRENCY) for tenant, calls in charges.items()}
+        async with admitted_for(charges):
+            fetched = await fan_out_batch(jobs, deadline, appConfig.BATCH_CONCURRENCY)
+    for index, (cache_key, fragment_keys) in pending.items():
+        results = {name: fetched[key] for name, key in fragment_keys.items()}
+        bodies[index] = set_cached_response(cache_key, get_output(results), store=succeeded(results))
+    body = b'{' + b','.join(b'"%d":%b' % (index, bodies[index]) for index in sorted(bodies)) + b'}'
+    return json_response(request, body)
 
 
 @router.get("/api/v1/date-updated")
@@ -213,43 +137,157 @@ async def get_updated_date():
     return {'updated': datetime.now().astimezone().strftime("%B %d, %Y %I:%M %p %Z")}
 
 
+async def get_review(route, request, request_params, background_tasks, stream=None, deadline=None):
+    metrics.mark_handler_start()
+    # Validated up front, so that a bad deadline is rejected whether or not the payload is cached.
+    deadline = route_deadline(route, deadline)
+    params, specs, upstream_params = prepare_review(route, request_params)
+    if stream:
+        return await stream_response(specs, upstream_params, deadline, stream, request.headers.get('accept-encoding'),
+                                     partial(admitted_stream, params, upstream_calls(specs, upstream_params)))
+    record_traffic(route, request_params.canonical())
+    cache_key = payload_key(route, params)
+    version = current_data_version()
+    # Complete payloads are fully determined by their params and the data version, so that is all the ETag hashes.
+    tag = etag(cache_key, version) if version is not None else None
+    if tag and etag_matches(request.headers.get('if-none-match'), tag):
+        headers = {'ETag': representation_tag(request, tag), 'Vary': 'Accept-Encoding'}
+        return Response(status_code=304, headers=headers)
+    cached, stale = await get_cached_response(cache_key)
+    if cached is not None:
+        if stale:
+            # Served right away; the refresh only starts once this response has been sent.
+            background_tasks.add_task(revalidate, cache_key,
+                                      partial(refresh_review, cache_key, specs, upstream_params, route))
+        return json_response(request, cached, tag)
+    async with admitted(params, upstream_calls(specs, upstream_params)):
+        results = await fan_out(specs, upstream_params, deadline)
+    complete = succeeded(results)
+    # Partial payloads get no ETag, so that a client never holds on to one with a 304.
+    body = set_cached_response(cache_key, get_output(results), store=complete)
+    return json_response(request, body, tag if complete else None)
+
+
+async def get_table(route, table, request, request_params, deadline=None):
+    metrics.mark_handler_start()
+    deadline = route_deadline(route, deadline)
+    params, _, upstream_params = prepare_review(route, request_params)
+    spec = route_table(route, table, params)
+    options, full_table_params = split_options(upstream_params)
+    options.setdefault('page', '1')
+    upstream_paging = spec.name in appConfig.TABLE_UPSTREAM_PAGING
+    fetch_params = upstream_params if upstream_paging else full_table_params
+    async with admitted(params, upstream_calls([spec], fetch_params)):
+        results = await fan_out([spec], fetch_params, deadline)
+    result = results[spec.name]
+    if isinstance(result, Exception):
+        print(f'Fragment {spec.name} failed: {result!r}')
+        return JSONResponse({'msg': f'{spec.name} is unavailable'}, status_code=502)
+    # The data service's own paging does not tell us the row count.
+    fragment, total = (result, None) if upstream_paging else paginate(result, options)
+    extra = {
+        'page': int(options['page']),
+        'page_size': int(options.get('page_size', appConfig.TABLE_PAGE_SIZE)),
+        'total': total,
+    }
+    if isinstance(result, StaleFragment):
+        extra['stale'] = [spec.name]
+    return json_response(request, render([fragment], extra))
+
+
+async def refresh_review(cache_key, specs, upstream_params, route):
+    async with admitted_for({BACKGROUND: upstream_calls(specs, upstream_params)}):
+        results = await fan_out(specs, upstream_params, route_deadline(route))
+    set_cached_response(cache_key, get_output(results), store=succeeded(results))
+
+
+async def warm_review(route, filters):
+    """Pre-computes and caches a route's payload, so the first user after a data refresh doesn't wait for it."""
+    params, specs, upstream_params = prepare_review(route, ROUTE_PARAMS[route].from_filters(filters))
+    cache_key = payload_key(route, params)
+    # Every worker warms the same hot set; all but the first find it in the shared cache.
+    if await get_shared_response(cache_key) is not None:
+        return
+    await refresh_review(cache_key, specs, upstream_params, route)
+
+
+def payload_key(route, params):
+    # Converted amounts change with the FX table as well as with the data, so the key, and with it the ETag, does too.
+    key = response_cache_key(route, params)
+    fx_version = currency.rates_version(params.get('currency_code'))
+    return f'{key}:fx={fx_version}' if fx_version else key
+
+
+def prepare_review(route, request_params):
+    params = set_default_dates(request_params)
+    specs = route_fragments(route, params, params.get('sections'))
+    upstream_params = {key: value for key, value in params.items() if key not in SERVICE_PARAMS}
+    return params, specs, upstream_params
+
+
+def json_response(request, body, tag=None):
+    with metrics.timed('compress'), profiling.measured('compress'):
+        content, headers = encode(body, request.headers.get('accept-encoding'))
+    if tag:
+        headers['ETag'] = representation_tag(request, tag)
+    return Response(content=content, media_type='application/json', headers=headers)
+
+
+def representation_tag(request, tag):
+    # Each content coding the client may get is a representation of its own, with its own strong validator. It
+    # depends on the negotiated coding only, not on the body's size, so a 304 can send it before the body is known.
+    encoding = negotiate(request.headers.get('accept-encoding'))
+    return f'{tag[:-1]}-{encoding}"' if encoding else tag
+
+
+def succeeded(results):
+    # Payloads with missing or stale fragments are served but never cached.
+    return not any(isinstance(r, (Exception, StaleFragment)) for r in results.values())
+
+
+@lru_cache(maxsize=1)
+def default_window(year, month):
+    end_date = datetime(year, month, 1) + relativedelta(months=-1)
+    start_date = end_date + relativedelta(months=-11)
+    return f'{start_date.month}', f'{start_date.year}', f'{end_date.month}', f'{end_date.year}'
+
+
 def set_default_dates(request_params):
     now = datetime.now()
-    end_date = now + relativedelta(months=-1)
-    start_date = end_date + relativedelta(months=-11)
-    data = json.loads(request_params.json())
+    start_month, start_year, end_month, end_year = default_window(now.year, now.month)
+    data = request_params.canonical()
     data.update({
-        'start_month': request_params.start_month or f'{start_date.month}',
-        'start_year': request_params.start_year or f'{start_date.year}',
-        'end_month': request_params.end_month or f'{end_date.month}',
-        'end_year': request_params.end_year or f'{end_date.year}',
+        'start_month': request_params.start_month or start_month,
+        'start_year': request_params.start_year or start_year,
+        'end_month': request_params.end_month or end_month,
+        'end_year': request_params.end_year or end_year,
     })
     return data
 
 
+EXPECTED_FAILURES = (UpstreamError, CircuitOpenError, FragmentTimeout, httpx.HTTPError)
+
+
 def get_output(results):
-    out = {}
-    for r in results:
+    fragments = []
+    missing = []
+    stale = []
+    for name, r in results.items():
         if isinstance(r, Exception):
-            print(f'Exception occurred...{r.request}')
-            print(''.join(traceback.format_exception(etype=type(r), value=r, tb=r.__traceback__)))
-        elif r.status_code != 200:
-            print(f'Request failed.{r.request}')
+            print(f'Fragment {name} failed: {r!r}')
+            if not isinstance(r, EXPECTED_FAILURES):
+                print(''.join(traceback.format_exception(type(r), r, r.__traceback__)))
+            missing.append(name)
         else:
-           # print(r)
-           # print(r.status_code)
-            d = dict(r.json())
-            for key, value in d.items():
-                if key in out and type(value) is dict:
-                    if key == 'deal_management':
-                        for k, v in value.items():
-                            if k in out[key] and type(out[key][k]) is dict:
-                                out[key][k].update(v)
-                            elif type(out[key]) is dict:
-                                out[key].update(value)
-                    else:
-                        out[key].update(value)
-                else:
-                    out.update(d)
-
-    return out
+            if isinstance(r, StaleFragment):
+                stale.append(name)
+            fragments.append(r)
+
+    extra = {}
+    if missing:
+        # Fragments that failed or missed the deadline are reported instead of silently dropped.
+        extra['partial'] = True
+        extra['missing'] = missing
+    if stale:
+        extra['stale'] = stale
+    return render(fragments, extra)
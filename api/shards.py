@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+
+from api import upstream
+from api.cache import TTLCache
+from api.merge import Fragment, StaleFragment
+from config import appConfig
+
+# Not cleared on data refresh: closed months are not expected to change.
+closed_shards = TTLCache(appConfig.SHARD_CACHE_MAX_BYTES, appConfig.SHARD_CLOSED_MONTH_TTL)
+# Sharded fragments whose shards turned out to hold more than month-by-month lists.
+unshardable = set()
+
+
+def months(params):
+    """Months of the requested window as year * 12 + month - 1, or None when it can't be sharded."""
+    try:
+        start = int(params['start_year']) * 12 + int(params['start_month']) - 1
+        end = int(params['end_year']) * 12 + int(params['end_month']) - 1
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not 0 <= end - start < appConfig.SHARD_MAX_MONTHS:
+        return None
+    return range(start, end + 1)
+
+
+def upstream_calls(specs, params):
+    """Most upstream calls fetching `specs` may take: one per fragment, or one per month of a sharded one."""
+    calls = 0
+    for spec in specs:
+        window = months(params) if spec.sharded and spec.name not in unshardable else None
+        calls += 1 if window is None else len(window)
+    return calls
+
+
+def is_closed(month):
+    now = datetime.now()
+    return month <= now.year * 12 + now.month - 1 - appConfig.SHARD_OPEN_MONTHS
+
+
+def shard_params(params, month):
+    year, month = f'{month // 12}', f'{month % 12 + 1}'
+    return {**params, 'start_month': month, 'start_year': year, 'end_month': month, 'end_year': year}
+
+
+async def fetch_shard(spec, params, month, timeout):
+    params = shard_params(params, month)
+    if not is_closed(month):
+        return await upstream.fetch(spec.url, params, timeout=timeout, ttl=spec.ttl, budget=spec.timeout)
+    key = upstream.fragment_key(spec.url, params)
+    fragment = closed_shards.get(key)
+    if fragment is None:
+        fragment = await upstream.fetch(spec.url, params, timeout=timeout, ttl=appConfig.SHARD_CLOSED_MONTH_TTL,
+                                          budget=spec.timeout)
+        if not isinstance(fragment, StaleFragment):
+            closed_shards.set(key, fragment, upstream.fragment_size(fragment.raw, key))
+    return fragment
+
+
+class ShardMismatch(Exception):
+    def __init__(self, key):
+        super().__init__(f'Shards disagree on {key}')
+        self.key = key
+
+
+def extend(out, shard):
+    # Shards are cached and shared, so their lists and dicts are replaced rather than modified.
+    for key, value in shard.items():
+        if key not in out:
+            out[key] = value
+            continue
+        existing = out[key]
+        if type(existing) is list and type(value) is list:
+            out[key] = existing + value
+        elif type(existing) is dict and type(value) is dict:
+            out[key] = extend(dict(existing), value)
+        elif existing != value:
+            # A total or other per-window value, which no single month's shard holds.
+            raise ShardMismatch(key)
+    return out
+
+
+def assemble(shards):
+    data = {}
+    for shard in shards:
+        extend(data, shard)
+    cls = StaleFragment if any(isinstance(shard, StaleFragment) for shard in shards) else Fragment
+    return cls(data, orjson.dumps(data))
+
+
+async def fetch(spec, params, timeout):
+    """Fetches a fragment spec, month by month if it is a sharded time series."""
+    window = months(params) if spec.sharded and spec.name not in unshardable else None
+    if window is not None:
+        shards = await asyncio.gather(*(fetch_shard(spec, params, month, timeout) for month in window))
+        try:
+            return assemble(shards)
+        except ShardMismatch as e:
+            print(f'Not sharding {spec.name} any more: {e}')
+            unshardable.add(spec.name)
+    return await upstream.fetch(spec.url, params, timeout=timeout, ttl=spec.ttl, budget=spec.timeout)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from config import appConfig
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+
+class MemoryBackend:
+    """In-process stand-in for Redis, shared by nothing but this worker. Meant for tests and single-worker runs."""
+
+    def __init__(self):
+        self._hashes = {}
+
+    async def hget(self, key, field):
+        entry = self._hashes.get(key)
+        if entry is None:
+            return None
+        expires_at, fields = entry
+        if expires_at <= time.monotonic():
+            del self._hashes[key]
+            return None
+        return fields.get(field)
+
+    async def hset(self, key, field, data, ttl):
+        entry = self._hashes.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            entry = self._hashes[key] = (time.monotonic() + ttl, {})
+        entry[1][field] = data
+
+    async def close(self):
+        self._hashes.clear()
+
+
+class RedisBackend:
+    def __init__(self, url):
+        if aioredis is None:
+            raise RuntimeError('SHARED_CACHE_BACKEND is redis but the redis package is not installed')
+        self.redis = aioredis.from_url(url)
+
+    async def hget(self, key, field):
+        return await self.redis.hget(key, field)
+
+    async def hset(self, key, field, data, ttl):
+        # The expiry applies to the whole hash, i.e. to every payload of one data version.
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.hset(key, field, data).expire(key, int(ttl)).execute()
+
+    async def close(self):
+        await self.redis.close()
+
+
+BACKENDS = {
+    'memory': lambda: MemoryBackend(),
+    'redis': lambda: RedisBackend(appConfig.SHARED_CACHE_URL),
+}
+
+_backend = None
+_writes = set()
+
+
+def get_backend():
+    global _backend
+    if _backend is None and appConfig.SHARED_CACHE_BACKEND in BACKENDS:
+        _backend = BACKENDS[appConfig.SHARED_CACHE_BACKEND]()
+    return _backend
+
+
+async def get_data_from_cache(key, field):
+    backend = get_backend()
+    if backend is None:
+        return None
+    try:
+        return await backend.hget(key, field)
+    except Exception as e:
+        print(f'Could not read {field} from the shared cache: {e!r}')
+        return None
+
+
+async def parse_data_to_cache(key, field, data, ttl=None):
+    backend = get_backend()
+    if backend is None:
+        return
+    try:
+        await backend.hset(key, field, data, ttl or appConfig.SHARED_CACHE_TTL)
+    except Exception as e:
+        print(f'Could not write {field} to the shared cache: {e!r}')
+
+
+def write_behind(key, field, data):
+    # Not awaited by the request that produced the payload; close_shared_cache() waits for what is left.
+    if get_backend() is None:
+        return
+    write = asyncio.ensure_future(parse_data_to_cache(key, field, data))
+    _writes.add(write)
+    write.add_done_callback(_writes.discard)
+
+
+async def close_shared_cache():
+    global _backend
+    if _writes:
+        await asyncio.wait(list(_writes), timeout=appConfig.SHUTDOWN_DRAIN_TIMEOUT)
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
@@ -0,0 +1,80 @@
+import orjson
+
+from api import currency
+from config import appConfig
+
+TABLE_PARAMS = ('page', 'page_size', 'sort', 'fields')
+
+
+def split_options(params):
+    """Splits the table options off the upstream params: ({options}, {params without them})."""
+    options = {key: params[key] for key in TABLE_PARAMS if params.get(key) is not None}
+    return options, {key: value for key, value in params.items() if key not in TABLE_PARAMS}
+
+
+def is_table(value):
+    return type(value) is list and all(type(row) is dict for row in value)
+
+
+def sort_key(value):
+    # Columns may mix types, which don't compare with each other: numbers sort before strings, and both before
+    # anything else, which is ordered by its JSON encoding.
+    if type(value) in (int, float, bool):
+        return 0, value
+    if type(value) is str:
+        return 1, value
+    return 2, orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+
+def page_rows(rows, options):
+    sort = options.get('sort')
+    if sort:
+        field = sort.lstrip('-')
+        # Rows without the column go last either way.
+        present = [row for row in rows if row.get(field) is not None]
+        rows = sorted(present, key=lambda row: sort_key(row[field]), reverse=sort.startswith('-')) + \
+            [row for row in rows if row.get(field) is None]
+    if 'page' in options or 'page_size' in options:
+        page_size = int(options.get('page_size', appConfig.TABLE_PAGE_SIZE))
+        start = (int(options.get('page', 1)) - 1) * page_size
+        rows = rows[start:start + page_size]
+    fields = options.get('fields')
+    if fields:
+        rows = [{field: row[field] for field in fields if field in row} for row in rows]
+    return rows
+
+
+def page_tables(value, options):
+    """Applies the table options to every list of rows found in `value`, returning (value, largest row count)."""
+    if is_table(value):
+        return page_rows(value, options), len(value)
+    if not isinstance(value, dict):
+        return value, 0
+    # Copied rather than modified in place: the fragment is shared with the cache.
+    paged = {}
+    total = 0
+    for key, v in value.items():
+        paged[key], rows = page_tables(v, options)
+        total = max(total, rows)
+    return paged, total
+
+
+def paginate(fragment, options):
+    """Returns the paged fragment and the number of rows of its largest table before paging."""
+    data, total = page_tables(fragment, options)
+    return type(fragment)(data, None), total
+
+
+async def fetch(spec, params, timeout):
+    """Fetches a fragment spec, paging and projecting it if it is a table and table options were given.
+
+    The full table is fetched and cached once, so every page and sort order of it is served from that one copy,
+    unless the data service pages the table itself.
+    """
+    options, params = split_options(params)
+    if not options or spec.section != 'tables':
+        return await currency.fetch(spec, params, timeout)
+    if spec.name in appConfig.TABLE_UPSTREAM_PAGING:
+        return await currency.fetch(spec, {**params, **options}, timeout)
+    fragment, _ = paginate(await currency.fetch(spec, params, timeout), options)
+    return fragment
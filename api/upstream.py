@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import defaultdict
+from functools import partial
+
+import httpx
+
+from api import retry
+from api.breaker import CircuitOpenError, breaker_for
+from api.merge import StaleFragment, decode
+from api.cache import TTLCache, add_refresh_listener, canonical_params, cache_key
+from config import appConfig
+
+
+class UpstreamError(Exception):
+    def __init__(self, url, status_code):
+        super().__init__(f'{url} returned {status_code}')
+        self.url = url
+        self.status_code = status_code
+
+
+def fragment_name(url):
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def fragment_key(url, params):
+    return cache_key(url, params)
+
+
+def fragment_size(raw, key):
+    # Estimated, as measuring the decoded dicts would cost about as much as decoding them. The constant covers the
+    # fixed overhead that dominates tiny fragments.
+    return int(appConfig.FRAGMENT_SIZE_FACTOR * len(raw)) + len(key) + 512
+
+
+fragment_cache = TTLCache(appConfig.FRAGMENT_CACHE_MAX_BYTES, appConfig.FRAGMENT_CACHE_TTL)
+fragment_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'coalesced': 0, 'stale': 0})
+add_refresh_listener(fragment_cache.clear)
+# Outlives data refreshes on purpose: an old copy beats an empty tile while the upstream is down.
+last_good_cache = TTLCache(appConfig.LAST_GOOD_CACHE_MAX_BYTES, appConfig.LAST_GOOD_CACHE_TTL)
+_in_flight = {}
+
+
+async def fetch(url, params, timeout=None, ttl=None, budget=None):
+    """`budget` is the fragment's own timeout; calls given less than that do not count against its breaker when they
+    time out. Fragments are shared between routes and requests: callers must treat the returned dict as read-only."""
+    params = canonical_params(params)
+    key = fragment_key(url, params)
+    data = fragment_cache.get(key)
+    if data is not None:
+        fragment_stats[url]['hits'] += 1
+        return data
+    load = _in_flight.get(key)
+    if load is not None:
+        fragment_stats[url]['coalesced'] += 1
+    elif not breaker_for(url).allow():
+        stale = last_good_cache.get(key)
+        if stale is None:
+            raise CircuitOpenError(url)
+        fragment_stats[url]['stale'] += 1
+        return StaleFragment(stale, stale.raw)
+    else:
+        fragment_stats[url]['misses'] += 1
+        load = _in_flight[key] = asyncio.ensure_future(_load(url, params, key, timeout, ttl, budget))
+        load.add_done_callback(partial(_forget_in_flight, key))
+    # Shielded so that one caller giving up does not cancel the call for everyone else awaiting it.
+    return await asyncio.shield(load)
+
+
+def _forget_in_flight(key, task):
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    if not task.cancelled():
+        # Marks the exception as retrieved even if every caller has already given up.
+        task.exception()
+
+
+async def drain(timeout):
+    # Loads outlive the requests that started them, so a stopping worker lets them finish and fill the caches.
+    if _in_flight:
+        await asyncio.wait(list(_in_flight.values()), timeout=timeout)
+
+
+async def _load(url, params, key, timeout, ttl, budget):
+    breaker = breaker_for(url)
+    started = time.monotonic()
+    try:
+        r = await retry.get(url, params=params, timeout=timeout)
+    except asyncio.CancelledError:
+        breaker.abandon()
+        raise
+    except Exception as e:
+        # A caller's deadline that is tighter than the fragment's budget says nothing about the upstream's health.
+        cut_short = timeout is not None and budget is not None and timeout < budget
+        if cut_short and isinstance(e, httpx.TimeoutException):
+            breaker.abandon()
+        else:
+            breaker.record(False, time.monotonic() - started)
+        raise
+    breaker.record(r.status_code < 500, time.monotonic() - started)
+    if r.status_code != 200:
+        raise UpstreamError(url, r.status_code)
+    data = await decode(url, r.content)
+    size = fragment_size(r.content, key)
+    fragment_cache.set(key, data, size, ttl=ttl)
+    last_good_cache.set(key, data, size)
+    return data
@@ -0,0 +1,90 @@
+import asyncio
+from collections import Counter
+
+from api.cache import cache_key, data_version
+from config import appConfig
+
+_traffic = Counter()
+_traffic_filters = {}
+_task = None
+_warm_task = None
+
+
+def record_traffic(route, filters):
+    """Counts the filters users actually ask for, so that the most popular ones are warmed too."""
+    if not appConfig.WARM_LEARNED_SIZE:
+        return
+    key = cache_key(route, filters)
+    _traffic[key] += 1
+    _traffic_filters.setdefault(key, (route, filters))
+    if len(_traffic) > 10 * appConfig.WARM_LEARNED_SIZE:
+        for key, _ in _traffic.most_common()[appConfig.WARM_LEARNED_SIZE:]:
+            del _traffic[key]
+            del _traffic_filters[key]
+
+
+def hot_set():
+    """(route, filters) pairs to pre-compute: the configured ones, then the most requested ones."""
+    hot = {}
+    for route in appConfig.WARM_ROUTES:
+        for filters in appConfig.WARM_FILTER_SETS:
+            hot.setdefault(cache_key(route, filters), (route, filters))
+    for key, _ in _traffic.most_common(appConfig.WARM_LEARNED_SIZE):
+        hot.setdefault(key, _traffic_filters[key])
+    return list(hot.values())
+
+
+async def warm(warm_one):
+    slots = asyncio.Semaphore(appConfig.WARM_CONCURRENCY)
+
+    async def run(route, filters):
+        async with slots:
+            try:
+                await warm_one(route, filters)
+            except Exception as e:
+                print(f'Warming {route} {filters} failed: {e!r}')
+
+    hot = hot_set()
+    await asyncio.gather(*(run(route, filters) for route, filters in hot))
+    print(f'Warmed {len(hot)} review payloads')
+
+
+async def run_warmer(warm_one):
+    """Keeps the data version current, off the request path, and starts warming the hot set whenever it changes.
+
+    Warming runs as a task of its own, so that however long it takes, the version is still checked on time.
+    """
+    global _warm_task
+    warmed_version = None
+    while True:
+        try:
+            # data_version() clears the caches itself when the data service has refreshed.
+            version = await data_version()
+            if appConfig.WARM_ENABLED and version is not None and version != warmed_version:
+                warmed_version = version
+                if _warm_task is not None:
+                    # Still warming payloads of the data that was just replaced.
+                    _warm_task.cancel()
+                _warm_task = asyncio.ensure_future(warm(warm_one))
+        except Exception as e:
+            print(f'Cache warmer failed: {e!r}')
+        await asyncio.sleep(appConfig.DATA_VERSION_CHECK_INTERVAL)
+
+
+def start_warmer(warm_one):
+    # Runs even with WARM_ENABLED off, as it is also what polls the data version.
+    global _task
+    if _task is None:
+        _task = asyncio.ensure_future(run_warmer(warm_one))
+
+
+async def stop_warmer():
+    global _task, _warm_task
+    for task in (_task, _warm_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _task = _warm_task = None
@@ -0,0 +1,170 @@
+"""Load benchmark of the review service against the stub data service in bench/stub.py.
+
+    python -m bench.run --requests 200 --concurrency 16 --save
+    python -m bench.run --routes review,performance --compare bench/results/<earlier run>.json
+
+Starts the stub and `main:app` as separate processes, runs every scenario of bench/scenarios.py and reports, per
+scenario, throughput, latency percentiles, upstream calls per request and the app's peak RSS. Saved results are
+named after the commit they were measured on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+import psutil
+
+from bench.scenarios import ROUTES, scenarios
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+COLUMNS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'upstream_per_request', 'errors', 'peak_rss_mb')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start(args, env):
+    return subprocess.Popen([sys.executable, *args], cwd=ROOT, env={**os.environ, **env})
+
+
+async def wait_until_up(client, url, process):
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f'{url} exited with {process.returncode}')
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def percentile(ordered, q):
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] if ordered else None
+
+
+async def sample_rss(process, peak):
+    while True:
+        peak[0] = max(peak[0], process.memory_info().rss)
+        await asyncio.sleep(0.05)
+
+
+async def run_scenario(client, app_url, stub_url, app_process, scenario, requests, concurrency):
+    if not scenario.cold:
+        await client.get(app_url + scenario.path, params=scenario.params())
+    await client.post(stub_url + '/__reset')
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            r = await client.get(app_url + scenario.path, params=scenario.params())
+            latencies.append(time.perf_counter() - started)
+            if r.status_code != 200 or b'"partial"' in r.content:
+                errors += 1
+
+    peak = [0]
+    sampler = asyncio.ensure_future(sample_rss(app_process, peak))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    upstream_calls = sum((await client.get(stub_url + '/__stats')).json().values())
+    latencies.sort()
+    return {
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'upstream_per_request': round(upstream_calls / requests, 2),
+        'errors': errors,
+        'peak_rss_mb': round(peak[0] / 2 ** 20, 1),
+    }
+
+
+def print_report(results, baseline=None):
+    width = max(len(name) for name in results)
+    print(f"{'scenario':<{width}}  " + '  '.join(f'{column:>20}' for column in COLUMNS))
+    for name, result in results.items():
+        cells = []
+        for column in COLUMNS:
+            cell = f'{result[column]}'
+            before = (baseline or {}).get(name, {}).get(column)
+            if before:
+                cell += f' ({(result[column] - before) / before:+.0%})'
+            cells.append(f'{cell:>20}')
+        print(f'{name:<{width}}  ' + '  '.join(cells))
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run(args):
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f'http://127.0.0.1:{stub_port}', f'http://127.0.0.1:{app_port}'
+    stub_args = ['-m', 'bench.stub', '--port', str(stub_port)] + (['--profile', args.profile] if args.profile else [])
+    stub = start(stub_args, {'DATA_SERVICE_HOST': stub_url})
+    app = start(['-m', 'uvicorn', 'main:app', '--port', str(app_port), '--log-level', 'warning'],
+                {'DATA_SERVICE_HOST': stub_url, 'PORT': str(app_port), 'WARM_ENABLED': 'false'})
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            await wait_until_up(client, stub_url + '/__stats', stub)
+            await wait_until_up(client, app_url + '/api/v1/date-updated', app)
+            for scenario in scenarios(args.routes):
+                results[scenario.name] = await run_scenario(client, app_url, stub_url, psutil.Process(app.pid),
+                                                            scenario, args.requests, args.concurrency)
+                print(f'{scenario.name}: {results[scenario.name]}', file=sys.stderr)
+    finally:
+        for process in (app, stub):
+            process.terminate()
+            process.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--routes', type=lambda value: value.split(','), help=f"any of {', '.join(ROUTES)}")
+    parser.add_argument('--profile', help='stub latency, error and size profile, see bench/stub.py')
+    parser.add_argument('--save', action='store_true', help=f'write the results to {RESULTS_DIR}')
+    parser.add_argument('--compare', help='earlier results file to show relative changes against')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        sha = commit()
+        path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{sha}.json")
+        with open(path, 'w') as f:
+            json.dump({'commit': sha, 'args': vars(args), 'results': results}, f, indent=2)
+        print(f'Saved {path}')
+
+
+if __name__ == '__main__':
+    main()
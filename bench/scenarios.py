@@ -0,0 +1,38 @@
+from collections import namedtuple
+from itertools import count, product
+
+Scenario = namedtuple('Scenario', 'name path params cold')
+
+ROUTES = {
+    'review': '/api/v1/review',
+    'performance': '/api/v1/review/performance',
+    'deal-management': '/api/v1/review/deal-management',
+    'customer-performance': '/api/v1/review/customer-performance',
+}
+AUDIENCES = {
+    'partner': {},
+    'distributor': {'sub_type': 'distributor', 'user_type': 'distributor'},
+}
+DATES = {
+    'default-dates': {},
+    'custom-dates': {'start_month': '1', 'start_year': '2021', 'end_month': '6', 'end_year': '2021'},
+}
+
+_unique = count()
+
+
+def params_for(audience, dates, cold):
+    params = {**AUDIENCES[audience], **DATES[dates]}
+
+    def params_factory():
+        if cold:
+            # A filter no other request uses misses both the payload and the fragment caches.
+            return {**params, 'geo': f'bench-{next(_unique)}'}
+        return params
+    return params_factory
+
+
+def scenarios(routes=None):
+    for route, audience, dates, cache in product(routes or ROUTES, AUDIENCES, DATES, ('cold', 'warm')):
+        yield Scenario(f'{route}/{audience}/{dates}/{cache}', ROUTES[route], params_for(audience, dates, cache == 'cold'),
+                       cache == 'cold')
@@ -0,0 +1,97 @@
+"""Stand-in for the data service, serving every URL in config.Config with made-up but realistically sized payloads.
+
+    python -m bench.stub --port 8599 --latency 0.05 --error-rate 0.01 --rows 200
+    python -m bench.stub --profile profile.json
+
+A profile is a JSON object of defaults plus per-fragment overrides, keyed like FRAGMENT_CACHE_TTLS:
+    {"latency": 0.05, "jitter": 0.5, "error_rate": 0, "rows": 50,
+     "fragments": {"opp-details-table": {"latency": 0.4, "rows": 5000}}}
+Latencies are log-normal around `latency` seconds, with `jitter` as sigma.
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config import appConfig
+
+DEFAULTS = {'latency': 0.05, 'jitter': 0.5, 'error_rate': 0.0, 'rows': 50}
+# Fragments that the review service merges under a shared top-level key.
+NESTED = {'transferred-in', 'transferred-out', 'closed-lost', 'deal-management-opp-details'}
+
+
+def data_service_paths():
+    host = f'{appConfig.DATA_SERVICE_HOST}'
+    return sorted({value[len(host):] for name, value in vars(type(appConfig)).items()
+                   if name.isupper() and isinstance(value, str) and value.startswith(f'{host}/api/')})
+
+
+def payload(name, rows, query):
+    table = [{'id': i, 'name': f'{name}-{i}', 'amount': round(random.uniform(0, 1e6), 2),
+              'percent': round(random.random(), 4), 'month': i % 12 + 1} for i in range(rows)]
+    if name == 'date-updated':
+        return {'updated': 'bench'}
+    if name in NESTED:
+        return {'deal_management': {name: {'rows': table, 'query': query}}}
+    return {name.replace('-', '_'): {'rows': table, 'query': query}}
+
+
+def create_app(profile):
+    calls = Counter()
+    bodies = {}
+
+    def settings(name):
+        return {**DEFAULTS, **{k: v for k, v in profile.items() if k != 'fragments'},
+                **profile.get('fragments', {}).get(name, {})}
+
+    async def serve(request):
+        path = request.url.path
+        name = path.rstrip('/').rsplit('/', 1)[-1]
+        calls[path] += 1
+        fragment = settings(name)
+        await asyncio.sleep(random.lognormvariate(0, fragment['jitter']) * fragment['latency'])
+        if random.random() < fragment['error_rate']:
+            return JSONResponse({'error': 'injected'}, status_code=500)
+        # Bodies are built once per query, so the stub itself stays cheap under load.
+        key = (path, str(request.query_params))
+        body = bodies.get(key)
+        if body is None:
+            body = bodies[key] = orjson.dumps(payload(name, fragment['rows'], key[1]))
+        return Response(body, media_type='application/json')
+
+    async def stats(request):
+        return JSONResponse(dict(calls))
+
+    async def reset(request):
+        calls.clear()
+        return JSONResponse({})
+
+    routes = [Route('/__stats', stats), Route('/__reset', reset, methods=['POST'])]
+    routes += [Route(path, serve) for path in data_service_paths()]
+    return Starlette(routes=routes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8599)
+    parser.add_argument('--profile', help='JSON file of latency, error and size settings')
+    for setting, default in DEFAULTS.items():
+        parser.add_argument(f"--{setting.replace('_', '-')}", type=type(default))
+    args = parser.parse_args()
+    profile = {}
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    profile.update({setting: getattr(args, setting) for setting in DEFAULTS if getattr(args, setting) is not None})
+    uvicorn.run(create_app(profile), port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 # config.py
+import json
 import os
 
 from dotenv import load_dotenv
@@ -10,6 +11,126 @@ class Config:
     PORT = os.getenv('PORT')
     DATA_SERVICE_HOST = os.getenv('DATA_SERVICE_HOST')
     DATA_SERVICE_PORT = os.getenv('DATA_SERVICE_PORT')
+    UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '30'))
+    UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv('UPSTREAM_MAX_CONNECTIONS_PER_HOST', '50'))
+    UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'false').lower() == 'true'
+    UPSTREAM_VERIFY_SSL = os.getenv('UPSTREAM_VERIFY_SSL', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '300'))
+    # How long past RESPONSE_CACHE_TTL a payload is still served while it is refreshed in the background.
+    RESPONSE_CACHE_STALE_TTL = float(os.getenv('RESPONSE_CACHE_STALE_TTL', '3600'))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    DATA_VERSION_CHECK_INTERVAL = float(os.getenv('DATA_VERSION_CHECK_INTERVAL', '60'))
+    DATA_VERSION_CHECK_TIMEOUT = float(os.getenv('DATA_VERSION_CHECK_TIMEOUT', '5'))
+    FRAGMENT_CACHE_TTL = float(os.getenv('FRAGMENT_CACHE_TTL', '300'))
+    # Memory bounds of the fragment, last-good and closed-shard caches. A decoded fragment is charged
+    # FRAGMENT_SIZE_FACTOR times its raw JSON size, which covers the raw bytes kept for splicing plus the decoded dicts:
+    # pympler puts those at 2-6x the raw size, about 4x for typical tables.
+    FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+    FRAGMENT_SIZE_FACTOR = float(os.getenv('FRAGMENT_SIZE_FACTOR', '5'))
+    # Per-fragment TTLs in seconds, keyed by the last path segment of the upstream URL, e.g. {"top-summary": 600}.
+    FRAGMENT_CACHE_TTLS = {'date-updated': 60, **json.loads(os.getenv('FRAGMENT_CACHE_TTLS', '{}'))}
+    # Overall time a review route may spend on its fan-out before answering with whatever has arrived.
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '30'))
+    ROUTE_DEADLINES = json.loads(os.getenv('ROUTE_DEADLINES', '{}'))
+    MAX_REQUEST_DEADLINE = float(os.getenv('MAX_REQUEST_DEADLINE', '60'))
+    # Shorter ?deadline= values are raised to this, so that a request can still be answered from the fragment cache.
+    MIN_REQUEST_DEADLINE = float(os.getenv('MIN_REQUEST_DEADLINE', '0.1'))
+    # Budget of a single upstream call, keyed like FRAGMENT_CACHE_TTLS.
+    FRAGMENT_TIMEOUT = float(os.getenv('FRAGMENT_TIMEOUT', '30'))
+    FRAGMENT_TIMEOUTS = {'date-updated': 5, **json.loads(os.getenv('FRAGMENT_TIMEOUTS', '{}'))}
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+    UPSTREAM_RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF', '0.1'))
+    # Per-fragment {"retries": int, "hedge": bool} overrides, keyed like FRAGMENT_CACHE_TTLS. A hedged fragment gets
+    # a duplicate request once the first one has been outstanding for longer than its observed p95.
+    UPSTREAM_POLICIES = {
+        'performance-over-time': {'hedge': True},
+        'peer-performance': {'hedge': True},
+        'opp-details-table': {'hedge': True},
+        'details-by-customer': {'hedge': True},
+        'deal-management-opp-details': {'hedge': True},
+        **json.loads(os.getenv('UPSTREAM_POLICIES', '{}'))
+    }
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    # Retries and hedges together may add at most this fraction of extra upstream load, plus a small burst.
+    RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.1'))
+    RETRY_BUDGET_BURST = float(os.getenv('RETRY_BUDGET_BURST', '10'))
+    # A breaker opens when at least BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls to its URL failed or took
+    # longer than BREAKER_SLOW_CALL seconds, and lets a probe through again after BREAKER_COOLDOWN seconds.
+    BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+    BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+    BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+    BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', '20'))
+    BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '30'))
+    LAST_GOOD_CACHE_TTL = float(os.getenv('LAST_GOOD_CACHE_TTL', str(24 * 60 * 60)))
+    LAST_GOOD_CACHE_MAX_BYTES = int(os.getenv('LAST_GOOD_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    # Upstream bodies larger than this are decoded in a worker thread instead of on the event loop.
+    DECODE_OFFLOAD_BYTES = int(os.getenv('DECODE_OFFLOAD_BYTES', str(1024 * 1024)))
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '50'))
+    # Upstream calls a single batch request may have outstanding at once.
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))
+    # Admin endpoints under /api/v1/admin are disabled unless a token is set; callers send it as X-Admin-Token.
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+    # After every data refresh the payloads of WARM_ROUTES are pre-computed for WARM_FILTER_SETS (filters as a user
+    # would send them; {} is the default window) plus the WARM_LEARNED_SIZE most requested filter sets.
+    WARM_ENABLED = os.getenv('WARM_ENABLED', 'true').lower() == 'true'
+    WARM_ROUTES = json.loads(os.getenv('WARM_ROUTES', '["review", "performance"]'))
+    WARM_FILTER_SETS = json.loads(os.getenv('WARM_FILTER_SETS', '[{}, {"sub_type": "distributor"}]'))
+    WARM_LEARNED_SIZE = int(os.getenv('WARM_LEARNED_SIZE', '20'))
+    WARM_CONCURRENCY = int(os.getenv('WARM_CONCURRENCY', '4'))
+    # With CURRENCY_CONVERSION on, fragments listed in MONETARY_FIELDS ({"opp-amount": ["amount", ...]}) are always
+    # fetched in USD and their fields converted here, at any depth, with rates (units per USD, {"EUR": 0.92, ...}) read
+    # from FX_RATES_FILE or FX_RATES_URL. Currencies without a rate are still converted by the data service.
+    CURRENCY_CONVERSION = os.getenv('CURRENCY_CONVERSION', 'false').lower() == 'true'
+    MONETARY_FIELDS = json.loads(os.getenv('MONETARY_FIELDS', '{}'))
+    FX_RATES_FILE = os.getenv('FX_RATES_FILE')
+    FX_RATES_URL = os.getenv('FX_RATES_URL')
+    FX_RATES_TTL = float(os.getenv('FX_RATES_TTL', '3600'))
+    # Time-series fragments, e.g. ["performance-over-time", "customer-retention-chart", "performance-chart-data"], that
+    # are requested one month at a time and assembled here by concatenating their lists, so that a sliding or
+    # overlapping window only fetches the months it does not have yet. Months older than the SHARD_OPEN_MONTHS most
+    # recent ones are closed: they are kept for SHARD_CLOSED_MONTH_TTL, across data refreshes.
+    SHARD_FRAGMENTS = json.loads(os.getenv('SHARD_FRAGMENTS', '[]'))
+    SHARD_OPEN_MONTHS = int(os.getenv('SHARD_OPEN_MONTHS', '2'))
+    SHARD_MAX_MONTHS = int(os.getenv('SHARD_MAX_MONTHS', '36'))
+    SHARD_CLOSED_MONTH_TTL = float(os.getenv('SHARD_CLOSED_MONTH_TTL', str(7 * 24 * 60 * 60)))
+    SHARD_CACHE_MAX_BYTES = int(os.getenv('SHARD_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    # Encodings offered to clients, most preferred first; br needs the brotli package. Bodies smaller than
+    # COMPRESSION_MIN_SIZE bytes are sent as they are. Cached payloads are stored with every encoding already applied.
+    COMPRESSION_ENCODINGS = json.loads(os.getenv('COMPRESSION_ENCODINGS', '["br", "gzip"]'))
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+    GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+    BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+    # Tables are paged, sorted and projected here over the cached full table, except the ones listed in
+    # TABLE_UPSTREAM_PAGING, which get page, page_size, sort and fields forwarded to the data service. With
+    # INLINE_TABLES off, review payloads leave the tables out and clients page through them on the table routes.
+    TABLE_PAGE_SIZE = int(os.getenv('TABLE_PAGE_SIZE', '50'))
+    TABLE_MAX_PAGE_SIZE = int(os.getenv('TABLE_MAX_PAGE_SIZE', '1000'))
+    TABLE_UPSTREAM_PAGING = json.loads(os.getenv('TABLE_UPSTREAM_PAGING', '[]'))
+    INLINE_TABLES = os.getenv('INLINE_TABLES', 'true').lower() == 'true'
+    # How often the event loop lag reported on /metrics is sampled.
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+    # Fan-outs reserve one slot per fragment: at most ADMISSION_MAX_UPSTREAM_CALLS overall and
+    # ADMISSION_TENANT_UPSTREAM_CALLS per partner_parent or distributor_parent. The rest wait in a queue of
+    # ADMISSION_MAX_QUEUE and are answered with 503 once it is full or they waited ADMISSION_QUEUE_TIMEOUT seconds.
+    ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+    ADMISSION_MAX_UPSTREAM_CALLS = int(os.getenv('ADMISSION_MAX_UPSTREAM_CALLS', '200'))
+    ADMISSION_TENANT_UPSTREAM_CALLS = int(os.getenv('ADMISSION_TENANT_UPSTREAM_CALLS', '50'))
+    ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '100'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '2'))
+    ADMISSION_RETRY_AFTER = float(os.getenv('ADMISSION_RETRY_AFTER', '2'))
+    # 'production' runs WORKERS processes, on uvloop and httptools when they are installed; anything else runs one
+    # debug worker.
+    CONFIGURATION_SETUP = os.getenv('CONFIGURATION_SETUP', 'development')
+    WORKERS = int(os.getenv('WORKERS', str(os.cpu_count() or 1)))
+    # How long a stopping worker waits for upstream calls and shared-cache writes that are still running.
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '10'))
+    # Review payloads cache shared by all workers: 'redis', 'memory' (per process, for tests) or 'none'.
+    SHARED_CACHE_BACKEND = os.getenv('SHARED_CACHE_BACKEND', 'none')
+    SHARED_CACHE_URL = os.getenv('SHARED_CACHE_URL', 'redis://localhost:6379/0')
+    # Shared payloads are keyed by data version, so this only bounds how long those of an old version linger.
+    SHARED_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL', '3600'))
     TOTAL_AND_ANNUALIZED_OPP_AMOUNT_URL = f"{DATA_SERVICE_HOST}/api/v1/review/total-opp-amount"
     TOP_SUMMARY_URL = f"{DATA_SERVICE_HOST}/api/v1/review/top-summary"
     PERFORMANCE_DATA_URL = f"{DATA_SERVICE_HOST}/api/v1/review/performance-data"
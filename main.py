@@ -6,7 +6,10 @@ from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
-from api.review import router
+from api import admin, client, currency, metrics, profiling, upstream, warmer
+from api.admission import Overloaded
+from api.review import router, warm_review
+from api.shared_cache import close_shared_cache
 from config import appConfig
 
 app = FastAPI()
@@ -18,7 +21,30 @@ app.add_middleware(
     allow_methods=['*'],
     allow_headers=['*']
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiling.MemoryMiddleware)
 app.include_router(router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
+
+
+@app.on_event('startup')
+async def startup():
+    await client.start_client()
+    warmer.start_warmer(warm_review)
+    currency.start_fx_refresher()
+    metrics.start_loop_monitor()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    await warmer.stop_warmer()
+    await currency.stop_fx_refresher()
+    await metrics.stop_loop_monitor()
+    # By now uvicorn has finished the requests in flight; what is left are the loads and writes they left behind.
+    await upstream.drain(appConfig.SHUTDOWN_DRAIN_TIMEOUT)
+    await close_shared_cache()
+    await client.close_client()
 
 
 @app.exception_handler(RequestValidationError)
@@ -29,10 +55,21 @@ def validation_exception_handler(request, exc):
     return JSONResponse(exc_json, status_code=422)
 
 
+@app.exception_handler(Overloaded)
+def overloaded_exception_handler(request, exc):
+    return JSONResponse({'msg': 'The service is overloaded. Please retry later.'}, status_code=503,
+                        headers={'Retry-After': str(exc.retry_after)})
+
+
 @app.exception_handler(ValueError)
 def validation_exception_handler(request, exc):
     return JSONResponse({'msg': str(exc)}, status_code=422)
 
 
 if __name__ == '__main__':
-    uvicorn.run(app, debug=True, port=int(appConfig.PORT), host='0.0.0.0')
+    if appConfig.CONFIGURATION_SETUP == 'production':
+        # Workers are started from the import string; 'auto' picks uvloop and httptools when they are installed.
+        uvicorn.run('main:app', port=int(appConfig.PORT), host='0.0.0.0', workers=appConfig.WORKERS, loop='auto',
+                    http='auto', log_level='info', proxy_headers=True)
+    else:
+        uvicorn.run(app, debug=True, port=int(appConfig.PORT), host='0.0.0.0')